@@ -1,14 +1,29 @@
 # bot.py
 # Slash-only Discord music bot with buttons UI, auto-leave, safe download cleanup, autocomplete, logging, PLAYLIST SUPPORT
 
+import time
+_STARTUP_T0 = time.perf_counter()
+
 import discord
 from discord.ext import commands, tasks
 from discord import app_commands, Interaction
-import yt_dlp as youtube_dl
 import os
 import asyncio
+import signal
+import bisect
+import hashlib
+import json
+import socket
+import sqlite3
+import subprocess
+import threading
+import weakref
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+import aiohttp
+from aiohttp import web
 from dotenv import load_dotenv
-from collections import deque
+from collections import deque, OrderedDict
 import re
 from pathlib import Path
 import logging
@@ -16,6 +31,11 @@ from logging.handlers import RotatingFileHandler
 from typing import Optional, Dict, List
 from datetime import datetime, timedelta
 
+try:
+    import fcntl  # cross-process single-flight for the shared cache (POSIX only)
+except ImportError:
+    fcntl = None
+
 load_dotenv()
 TOKEN = os.getenv("DISCORD_TOKEN")
 
@@ -47,10 +67,106 @@ logger.info("Bot starting up...")
 logger.info("=" * 60)
 
 # ---------------------- CONFIG / DIRECTORIES ----------------------
-DOWNLOAD_DIR = Path("music_downloads")
-DOWNLOAD_DIR.mkdir(exist_ok=True)
+# Optional cache shared by several bot processes on the same host (a common volume).
+# Downloads then land in a per-instance scratch dir inside it and are published to SHARED_CACHE_DIR/audio.
+SHARED_CACHE_DIR = Path(os.getenv("SHARED_CACHE_DIR")) if os.getenv("SHARED_CACHE_DIR") else None
+SHARED_CACHE_INSTANCE = os.getenv("SHARED_CACHE_INSTANCE") or f"{socket.gethostname()}-{os.getpid()}"
+SHARED_CACHE_MAX_BYTES = int(os.getenv("SHARED_CACHE_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+SHARED_CACHE_LEASE_TTL = 120.0  # leases not refreshed for this long belong to a dead instance
+
+if SHARED_CACHE_DIR is not None:
+    DOWNLOAD_DIR = SHARED_CACHE_DIR / "tmp" / SHARED_CACHE_INSTANCE
+    DOWNLOAD_DIR.mkdir(parents=True, exist_ok=True)
+else:
+    DOWNLOAD_DIR = Path("music_downloads")
+    DOWNLOAD_DIR.mkdir(exist_ok=True)
 logger.info(f"Download directory: {DOWNLOAD_DIR.resolve()}")
 
+# Small persistent state (command sync hash, caches, indexes)
+DATA_DIR = Path("data")
+DATA_DIR.mkdir(exist_ok=True)
+COMMAND_SYNC_STATE = DATA_DIR / "command_sync.json"
+FORCE_COMMAND_SYNC = os.getenv("FORCE_COMMAND_SYNC", "").lower() in ("1", "true", "yes")
+
+# Worker threads for blocking yt-dlp calls
+YTDL_WORKERS = int(os.getenv("YTDL_WORKERS", "8"))
+
+# Resolved tracks / downloaded audio kept for reuse (0 = delete files as soon as nothing plays them)
+AUDIO_CACHE_MAX_BYTES = int(os.getenv("AUDIO_CACHE_MAX_BYTES", "0"))
+TRACK_CACHE_INDEX = DATA_DIR / "track_cache.json"  # cached files, written on shutdown and reloaded at start
+
+# Speculative prefetch of the top autocomplete suggestion while the user is still typing
+SPECULATIVE_PREFETCH = os.getenv("SPECULATIVE_PREFETCH", "").lower() in ("1", "true", "yes")
+SPECULATIVE_DOWNLOAD = os.getenv("SPECULATIVE_DOWNLOAD", "").lower() in ("1", "true", "yes")
+SPECULATIVE_MAX_PER_GUILD = int(os.getenv("SPECULATIVE_MAX_PER_GUILD", "1"))        # fetches in flight
+SPECULATIVE_MAX_BYTES = int(os.getenv("SPECULATIVE_MAX_BYTES", str(200 * 1024 * 1024)))  # unclaimed files
+SPECULATIVE_MAX_FILESIZE = 30 * 1024 * 1024   # larger downloads are skipped
+SPECULATIVE_TTL = 600.0                       # unclaimed prefetches are dropped after this long
+TRACK_CACHE_MAX_METADATA = 500                # metadata-only cache entries kept (LRU)
+SPECULATIVE_SETTLE = float(os.getenv("SPECULATIVE_SETTLE", "0.5"))  # suggestion must stay on top this long
+
+# Catalog links (Spotify playlists/albums/tracks) resolved to YouTube videos
+SPOTIFY_CLIENT_ID = os.getenv("SPOTIFY_CLIENT_ID")
+SPOTIFY_CLIENT_SECRET = os.getenv("SPOTIFY_CLIENT_SECRET")
+CATALOG_MAP_FILE = DATA_DIR / "catalog_map.json"   # catalog track id -> video id
+CATALOG_RESOLVE_CONCURRENCY = int(os.getenv("CATALOG_RESOLVE_CONCURRENCY", "4"))
+CATALOG_MAX_TRACKS = 500
+CATALOG_MATCH_THRESHOLD = 1.0
+
+# Playlist snapshots: reloads only resolve what changed since the last load
+PLAYLIST_SNAPSHOT_DIR = DATA_DIR / "playlists"
+PLAYLIST_SNAPSHOT_DIR.mkdir(exist_ok=True)
+PLAYLIST_INFO_TTL = 3 * 3600          # resolved stream URLs expire after a few hours
+PLAYLIST_UNAVAILABLE_TTL = 24 * 3600  # re-check known unavailable videos after this long
+PLAYLIST_SNAPSHOT_MAX_AGE = 30 * 24 * 3600  # snapshots of playlists not loaded for this long are deleted
+
+# Graceful shutdown (SIGTERM): docker waits 10s by default before SIGKILL
+SHUTDOWN_DEADLINE = float(os.getenv("SHUTDOWN_DEADLINE", "8"))
+RESUME_STATE = DATA_DIR / "resume.json"   # playback positions restored after a restart
+RESUME_MAX_AGE = 900                      # ignore resume state older than this (s)
+
+# Optional post-download transcoding of cached audio to one compact Ogg/Opus profile
+TRANSCODE_AUDIO = os.getenv("TRANSCODE_AUDIO", "").lower() in ("1", "true", "yes")
+TRANSCODE_BITRATE = os.getenv("TRANSCODE_BITRATE", "96k")
+TRANSCODE_WORKERS = int(os.getenv("TRANSCODE_WORKERS", "2"))
+TRANSCODE_TIMEOUT = 600  # seconds per file
+TRANSCODE_EXT = "opus"
+
+# Pacing of yt-dlp network calls toward the media source
+MEDIA_RATE = float(os.getenv("MEDIA_RATE", "2.0"))        # sustained calls per second once throttled
+MEDIA_BURST = int(os.getenv("MEDIA_BURST", "5"))
+MEDIA_MIN_RATE = 0.1                                      # floor while backing off
+MEDIA_THROTTLE_RETRIES = 3                                # retries of a call that hit throttling
+MEDIA_BACKOFF_BASE = 2.0
+MEDIA_BACKOFF_MAX = 60.0
+MEDIA_INTERACTIVE_MAX_WAIT = 5.0                          # interactive calls never wait longer on backoff
+MEDIA_BREAKER_THRESHOLD = 5                               # throttling errors within the window...
+MEDIA_BREAKER_WINDOW = 60.0
+MEDIA_BREAKER_COOLDOWN = 60.0                             # ...pause bulk work for this long
+
+# Read-ahead buffer between ffmpeg and the voice thread (0 = read the pipe directly)
+AUDIO_READAHEAD_SECONDS = float(os.getenv("AUDIO_READAHEAD_SECONDS", "0"))
+
+# Audio frame timing: rolling window for the worst-guild report (0 interval = no report)
+AUDIO_STATS_WINDOW = 60.0
+AUDIO_STATS_SLOTS = 6
+AUDIO_JITTER_REPORT_INTERVAL = float(os.getenv("AUDIO_JITTER_REPORT_INTERVAL", "60"))
+
+# Prometheus metrics endpoint (disabled when METRICS_PORT is 0)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Autocomplete result cache
+AUTOCOMPLETE_CACHE_TTL = 300.0
+AUTOCOMPLETE_CACHE_SIZE = 256
+
+# Now Playing panel: one message per guild, edited in place
+PROGRESS_BAR_LENGTH = 20
+NOW_PLAYING_EDIT_WINDOW = 2.0       # min seconds between API calls on one channel route
+NOW_PLAYING_MAX_EDIT_WINDOW = 30.0  # upper bound when Discord keeps throttling a route
+NOW_PLAYING_MIN_REFRESH = 10.0      # live progress refresh interval bounds (seconds)
+NOW_PLAYING_MAX_REFRESH = 60.0
+
 # ---------------------- BOT SETUP ----------------------
 intents = discord.Intents.default()
 intents.message_content = False
@@ -58,7 +174,25 @@ intents.voice_states = True
 intents.guilds = True
 intents.members = True
 
-bot = commands.Bot(command_prefix="!", intents=intents)
+class MusicBot(commands.Bot):
+    async def setup_hook(self):
+        logger.info(f"Logged in after {time.perf_counter() - _STARTUP_T0:.2f}s")
+        # Persistent views must be registered before the gateway starts dispatching interactions
+        register_persistent_views()
+        # Load yt-dlp and its extractors off the event loop while the gateway connects
+        self._ytdl_warmup = self.loop.run_in_executor(None, prewarm_yt_dlp)
+        if METRICS_PORT:
+            await start_metrics_server()
+        try:
+            self.loop.add_signal_handler(signal.SIGTERM, shutdown.request, "SIGTERM")
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows: no loop signal handlers, Ctrl+C still works
+
+    async def close(self):
+        await spotify_client.close()
+        await super().close()
+
+bot = MusicBot(command_prefix="!", intents=intents)
 tree = bot.tree
 
 # ---------------------- UTILS ----------------------
@@ -76,6 +210,364 @@ def safe_create_task(coro: asyncio.coroutines) -> asyncio.Task:
         except Exception:
             raise RuntimeError("Unable to schedule coroutine; no event loop available")
 
+# ---------------------- METRICS ----------------------
+# Minimal Prometheus-style metrics. Updates are a couple of attribute writes (no locks, no
+# allocation) so they are safe to call from the per-track and per-frame paths; a lost
+# increment under thread contention is acceptable for monitoring data.
+def _escape_label(value) -> str:
+    # Titles and guild names end up here: escape as the exposition format requires
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(names, values, extra: str = "") -> str:
+    parts = [f'{n}="{_escape_label(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class _CounterValue:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+class _HistogramValue:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Metric(ABC):
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+
+    @abstractmethod
+    def render(self) -> List[str]:
+        """Exposition lines; subclasses extend this HELP/TYPE header."""
+        help_text = self.help_text.replace("\\", "\\\\").replace("\n", "\\n")
+        return [f"# HELP {self.name} {help_text}", f"# TYPE {self.name} {self.kind}"]
+
+class _ChildMetric(Metric):
+    """Metric storing a value object per label combination."""
+    def __init__(self, name: str, help_text: str, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self._children: Dict[tuple, object] = {}
+
+    @abstractmethod
+    def _new_child(self):
+        ...
+
+    def labels(self, *values):
+        """Child for a label combination; callers on hot paths should keep the returned object."""
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+class Counter(_ChildMetric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterValue()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for values, child in list(self._children.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, values)} {child.value}")
+        return lines
+
+class Histogram(_ChildMetric):
+    kind = "histogram"
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self, name: str, help_text: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.bounds = list(buckets)
+
+    def _new_child(self):
+        return _HistogramValue(self.bounds)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for values, child in list(self._children.items()):
+            cumulative = 0
+            for bound, count in zip(self.bounds + [float("inf")], child.counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, values)
+            lines.append(f"{self.name}_sum{labels} {child.sum}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+class Gauge(Metric):
+    """Gauge computed at scrape time: fn returns a number, or a {label values: number} dict."""
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, fn, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self.fn = fn
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        try:
+            value = self.fn()
+        except Exception as e:
+            logger.debug(f"Gauge {self.name} failed: {e}")
+            return lines
+        if isinstance(value, dict):
+            for values, v in value.items():
+                lines.append(f"{self.name}{_format_labels(self.labelnames, values)} {v}")
+        else:
+            lines.append(f"{self.name} {value}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames=()) -> Counter:
+        return self.register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name: str, help_text: str, labelnames=(), buckets=Histogram.DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+
+    def gauge(self, name: str, help_text: str, fn, labelnames=()) -> Gauge:
+        return self.register(Gauge(name, help_text, fn, labelnames))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+
+# Sources that may still own an ffmpeg child (weak, so finished sources drop out on their own)
+_live_sources: "weakref.WeakSet" = weakref.WeakSet()
+
+def _count_ffmpeg_processes() -> int:
+    count = 0
+    for source in list(_live_sources):
+        proc = getattr(getattr(source, "original", None), "_process", None)
+        if proc is not None and proc.poll() is None:
+            count += 1
+    return count
+
+def _download_dir_bytes() -> int:
+    total = 0
+    with os.scandir(DOWNLOAD_DIR) as it:
+        for entry in it:
+            try:
+                if entry.is_file():
+                    total += entry.stat().st_size
+            except OSError:
+                pass
+    return total
+
+play_to_first_audio_seconds = metrics.histogram(
+    "musicbot_play_to_first_audio_seconds", "Time from /play to the first audio frame being read")
+ytdl_duration_seconds = metrics.histogram(
+    "musicbot_ytdl_duration_seconds", "yt-dlp call duration by operation", ("operation",),
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 40.0, 80.0, 160.0))
+autocomplete_latency_seconds = metrics.histogram(
+    "musicbot_autocomplete_latency_seconds", "yt_autocomplete latency")
+autocomplete_cache_total = metrics.counter(
+    "musicbot_autocomplete_cache_total", "Autocomplete cache lookups by result", ("result",))
+after_play_lag_seconds = metrics.histogram(
+    "musicbot_after_play_lag_seconds", "Delay between the voice thread's after callback and the event loop running it")
+tracks_started_total = metrics.counter("musicbot_tracks_started_total", "Tracks handed to the voice client")
+metrics.gauge("musicbot_ytdl_executor_queue_depth", "yt-dlp jobs waiting for a worker thread",
+              lambda: ytdl_executor._work_queue.qsize())
+metrics.gauge("musicbot_guild_queue_length", "Queued tracks per guild",
+              lambda: {(gid,): len(p.queue) for gid, p in list(players.items())}, ("guild",))
+metrics.gauge("musicbot_ffmpeg_processes_active", "Running ffmpeg child processes", _count_ffmpeg_processes)
+metrics.gauge("musicbot_download_dir_bytes", "Bytes stored in the download directory", _download_dir_bytes)
+
+async def _metrics_handler(request: web.Request) -> web.Response:
+    # Scrape-time gauges touch the filesystem; keep that off the event loop
+    body = await asyncio.get_running_loop().run_in_executor(None, metrics.render)
+    return web.Response(text=body, content_type="text/plain", charset="utf-8")
+
+async def start_metrics_server():
+    """Serve /metrics in Prometheus text format on METRICS_HOST:METRICS_PORT."""
+    web_app = web.Application()
+    web_app.router.add_get("/metrics", _metrics_handler)
+    runner = web.AppRunner(web_app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, METRICS_HOST, METRICS_PORT).start()
+    logger.info(f"Metrics endpoint listening on http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
+# ---------------------- MEDIA SOURCE RATE LIMITING ----------------------
+THROTTLE_MARKERS = (
+    "http error 429",
+    "too many requests",
+    "sign in to confirm you",
+    "not a bot",
+    "rate-limit",
+    "ratelimit",
+)
+
+def is_throttling_error(message: str) -> bool:
+    """True if a yt-dlp error means the media source is throttling us rather than the video being bad."""
+    message = message.lower()
+    return any(marker in message for marker in THROTTLE_MARKERS)
+
+class MediaRateLimiter:
+    """
+    Token bucket in front of every yt-dlp network call.
+    Calls are not paced until the media source first throttles us (YtdlLogHook / a failed
+    call); from then on the bucket applies, throttling errors halve the rate and impose an
+    exponential backoff, and successes slowly restore it. Once the rate is back at the base
+    and no throttling was seen for MEDIA_BREAKER_WINDOW, pacing switches off again.
+    Repeated throttling opens a circuit breaker that holds back bulk work (playlist
+    prefetch) while interactive calls still go through.
+    """
+    INTERACTIVE = "interactive"
+    BULK = "bulk"
+
+    def __init__(self, rate: float, burst: int):
+        self.base_rate = rate
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self.backoff_until = 0.0
+        self.breaker_open_until = 0.0
+        self._consecutive_throttles = 0
+        self._recent_throttles: deque = deque()
+        self.pacing = False  # set by the first throttle signal
+        self._last_throttle = 0.0
+        # record_* are called from yt-dlp worker threads
+        self._lock = threading.Lock()
+
+    def breaker_open(self) -> bool:
+        return time.monotonic() < self.breaker_open_until
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def available(self) -> float:
+        """Tokens available right now (refilled first; the burst size while not pacing)."""
+        if not self.pacing:
+            return float(self.burst)
+        self._refill(time.monotonic())
+        return self.tokens
+
+    async def acquire(self, priority: str = INTERACTIVE):
+        """Wait until a call of the given priority may go out."""
+        # Bulk work leaves one token for interactive calls so a playlist can't starve /play
+        needed = 1.0 if priority == self.INTERACTIVE or self.burst == 1 else 2.0
+        waited = 0.0
+        while True:
+            now = time.monotonic()
+            if priority == self.BULK and now < self.breaker_open_until:
+                await asyncio.sleep(self.breaker_open_until - now)
+                continue
+            if now < self.backoff_until:
+                delay = self.backoff_until - now
+                if priority == self.INTERACTIVE:
+                    delay = min(delay, max(MEDIA_INTERACTIVE_MAX_WAIT - waited, 0.0))
+                if delay > 0:
+                    waited += delay
+                    await asyncio.sleep(delay)
+                    continue
+            if not self.pacing:
+                return
+            self._refill(now)
+            if self.tokens >= needed:
+                self.tokens -= 1.0
+                return
+            await asyncio.sleep((needed - self.tokens) / self.rate)
+
+    def record_throttle(self):
+        with self._lock:
+            now = time.monotonic()
+            if not self.pacing:
+                self.pacing = True
+                self.tokens = 0.0  # the burst was already spent unpaced
+                self._updated = now
+            self._last_throttle = now
+            self._recent_throttles.append(now)
+            while self._recent_throttles and now - self._recent_throttles[0] > MEDIA_BREAKER_WINDOW:
+                self._recent_throttles.popleft()
+            media_throttled_total.inc()
+            if len(self._recent_throttles) >= MEDIA_BREAKER_THRESHOLD and now >= self.breaker_open_until:
+                self.breaker_open_until = now + MEDIA_BREAKER_COOLDOWN
+                logger.warning(f"Media source is throttling; pausing bulk extraction for {MEDIA_BREAKER_COOLDOWN:.0f}s")
+            if now < self.backoff_until:
+                return  # a call already in flight when the backoff started: the rate was cut for it
+            self._consecutive_throttles += 1
+            self.rate = max(self.rate / 2, MEDIA_MIN_RATE)
+            backoff = min(MEDIA_BACKOFF_BASE * 2 ** (self._consecutive_throttles - 1), MEDIA_BACKOFF_MAX)
+            self.backoff_until = now + backoff
+            logger.warning(f"Throttled by media source; backing off {backoff:.1f}s, rate now {self.rate:.2f}/s")
+
+    def record_success(self):
+        with self._lock:
+            self._consecutive_throttles = 0
+            if self.rate < self.base_rate:
+                self.rate = min(self.base_rate, self.rate * 1.1)
+            elif self.pacing and time.monotonic() - self._last_throttle > MEDIA_BREAKER_WINDOW:
+                self.pacing = False
+                logger.info("Media source has recovered; yt-dlp calls are no longer paced")
+
+media_throttled_total = metrics.counter("musicbot_media_throttled_total", "Throttling responses from the media source")
+media_limiter = MediaRateLimiter(MEDIA_RATE, MEDIA_BURST)
+metrics.gauge("musicbot_media_rate", "Current yt-dlp call rate allowance (calls/s)", lambda: media_limiter.rate)
+metrics.gauge("musicbot_media_breaker_open", "1 while bulk extraction is paused", lambda: int(media_limiter.breaker_open()))
+
+# Per worker thread: whether the running yt-dlp job already reported throttling
+_ytdl_job_state = threading.local()
+
+def note_ytdl_error(error) -> bool:
+    """Inspect a yt-dlp error/log line; reports throttling to the limiter once per job."""
+    if not is_throttling_error(str(error)):
+        return False
+    if not getattr(_ytdl_job_state, "throttled", False):
+        _ytdl_job_state.throttled = True
+        media_limiter.record_throttle()
+    return True
+
+class YtdlLogHook:
+    """yt-dlp logger: stays quiet like before, but lets throttling messages reach the rate limiter."""
+    def debug(self, msg):
+        pass
+
+    def info(self, msg):
+        pass
+
+    def warning(self, msg):
+        note_ytdl_error(msg)
+
+    def error(self, msg):
+        note_ytdl_error(msg)
+
 # ---------------------- YTDL / FFMPEG ----------------------
 ytdl_format_options = {
     "format": "bestaudio/best",
@@ -91,14 +583,268 @@ ytdl_format_options = {
     "ignoreerrors": True,  # folytassa hibák esetén
     "no_color": True,
     "cookiefile": None,  # opcionálisan add hozzá a cookie fájlt ha van
+    "logger": YtdlLogHook(),
 }
 
 ffmpeg_options = {"options": "-vn"}
 
-ytdl = youtube_dl.YoutubeDL(ytdl_format_options)
+def create_audio_source(location: str, start: float = 0.0) -> discord.AudioSource:
+    """PCM source for a downloaded file or stream URL (the benchmark harness swaps this out)."""
+    before = f"-ss {start:.2f}" if start else None
+    return discord.FFmpegPCMAudio(location, executable="ffmpeg", before_options=before, **ffmpeg_options)
+
+readahead_underruns_total = metrics.counter(
+    "musicbot_audio_readahead_underruns_total", "Voice thread reads that found the read-ahead buffer empty")
+
+class ReadAheadAudio(discord.AudioSource):
+    """
+    Decouples the voice thread from the ffmpeg pipe: a reader thread fills a ring of
+    preallocated 20 ms frames (one bytearray, fixed memoryview slots) up to `frames` ahead,
+    and read() only hands out the next filled slot. A slot is recycled on the following
+    read(), after the caller (PCMVolumeTransformer) has copied it. The first read waits for
+    PRIME_FRAMES (or EOF); after that, an empty ring that the reader refills later is an
+    underrun: waited out like a slow pipe read and counted. Waiting into EOF is not counted.
+    """
+    PRIME_FRAMES = 10  # 200 ms
+
+    def __init__(self, inner: discord.AudioSource, frames: int):
+        self.inner = inner
+        self.frames = max(frames, 2)
+        self._buffer = bytearray(self.frames * FRAME_BYTES)
+        view = memoryview(self._buffer)
+        self._slots = [view[i * FRAME_BYTES:(i + 1) * FRAME_BYTES] for i in range(self.frames)]
+        self._lengths = [0] * self.frames
+        self._head = 0        # next slot the voice thread reads
+        self._count = 0       # filled slots, including the one handed out last
+        self._handed_out = False
+        self._primed = False
+        self._eof = False
+        self._closed = False
+        self.underruns = 0
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._fill, name="audio-readahead", daemon=True)
+        self._thread.start()
+
+    @property
+    def _process(self):
+        return getattr(self.inner, "_process", None)
+
+    def _read_frame_into(self, slot: memoryview) -> int:
+        pipe = getattr(self.inner, "_stdout", None)
+        if pipe is None or not hasattr(pipe, "readinto"):
+            data = self.inner.read()
+            slot[:len(data)] = data
+            return len(data)
+        filled = 0
+        while filled < FRAME_BYTES:
+            n = pipe.readinto(slot[filled:])
+            if not n:
+                # Mint FFmpegPCMAudio.read: a partial last frame ends the track
+                return 0
+            filled += n
+        return filled
+
+    def _fill(self):
+        try:
+            while True:
+                with self._cond:
+                    while self._count >= self.frames and not self._closed:
+                        self._cond.wait()
+                    if self._closed:
+                        return
+                    tail = (self._head + self._count) % self.frames
+                size = self._read_frame_into(self._slots[tail])
+                with self._cond:
+                    if size == 0:
+                        return
+                    self._lengths[tail] = size
+                    self._count += 1
+                    self._cond.notify_all()
+        except (ValueError, OSError, AttributeError):
+            pass  # pipe closed under us by cleanup()
+        except Exception as e:
+            logger.debug(f"Read-ahead reader stopped: {e}")
+        finally:
+            with self._cond:
+                self._eof = True
+                self._cond.notify_all()
+
+    def read(self):
+        with self._cond:
+            if self._handed_out:
+                # The previous slot has been consumed; give it back to the reader
+                self._head = (self._head + 1) % self.frames
+                self._count -= 1
+                self._handed_out = False
+                self._cond.notify_all()
+            if not self._primed:
+                while self._count < min(self.frames, self.PRIME_FRAMES) and not self._eof and not self._closed:
+                    self._cond.wait(0.5)
+                self._primed = True
+            elif self._count == 0 and not self._eof and not self._closed:
+                while self._count == 0 and not self._eof and not self._closed:
+                    self._cond.wait(0.5)
+                if self._count:
+                    self.underruns += 1
+                    readahead_underruns_total.inc()
+            if self._count == 0 or self._closed:
+                return b""
+            self._handed_out = True
+            slot = self._slots[self._head]
+            size = self._lengths[self._head]
+        return slot if size == FRAME_BYTES else slot[:size]
+
+    def is_opus(self) -> bool:
+        return False
+
+    def cleanup(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self.inner.cleanup()
+
+def open_pcm_source(location: str, start: float = 0.0) -> discord.AudioSource:
+    """create_audio_source, behind a read-ahead buffer when AUDIO_READAHEAD_SECONDS is set."""
+    source = create_audio_source(location, start)
+    if AUDIO_READAHEAD_SECONDS > 0:
+        source = ReadAheadAudio(source, int(AUDIO_READAHEAD_SECONDS / FRAME_PERIOD))
+    return source
+
+class DeferredAudioSource(discord.AudioSource):
+    """
+    Starts the real (ffmpeg) source on the first read instead of at queue time.
+    A queued playlist no longer holds one idle ffmpeg process per track, and the
+    location can still be swapped (e.g. for a transcoded file) until playback starts.
+    The voice thread opens the source and the loop thread swaps the location under the
+    same lock, so a swap can never race ffmpeg opening the old file.
+    """
+    def __init__(self, location: str, start: float = 0.0):
+        self.location = location
+        self.start = start  # seconds to seek into the file (resumed playback)
+        self._source: Optional[discord.AudioSource] = None
+        self._closed = False
+        self._open_lock = threading.Lock()
+
+    @property
+    def started(self) -> bool:
+        return self._source is not None
+
+    @property
+    def _process(self):
+        return getattr(self._source, "_process", None)
+
+    def read(self) -> bytes:
+        if self._source is None:
+            with self._open_lock:
+                if self._closed:
+                    return b""
+                if self._source is None:
+                    self._source = open_pcm_source(self.location, self.start)
+        return self._source.read()
+
+    def swap_location(self, location: str, approve=None) -> bool:
+        """Point at another file if nothing has been opened yet; `approve()` may still veto."""
+        with self._open_lock:
+            if self._source is not None or self._closed:
+                return False
+            if approve is not None and not approve():
+                return False
+            self.location = location
+            return True
+
+    def is_opus(self) -> bool:
+        return False
+
+    def cleanup(self):
+        with self._open_lock:
+            self._closed = True
+        if self._source is not None:
+            self._source.cleanup()
+
+# yt-dlp is imported lazily: loading it and its extractors dominates cold start.
+_yt_dlp_module = None
+_ytdl = None
+_ytdl_lock = threading.Lock()
+
+def get_yt_dlp():
+    """Import yt-dlp on first use (thread-safe)."""
+    global _yt_dlp_module
+    if _yt_dlp_module is None:
+        with _ytdl_lock:
+            if _yt_dlp_module is None:
+                started = time.perf_counter()
+                import yt_dlp
+                _yt_dlp_module = yt_dlp
+                logger.info(f"yt-dlp imported in {time.perf_counter() - started:.2f}s")
+    return _yt_dlp_module
+
+def get_ytdl():
+    """Shared YoutubeDL instance built from ytdl_format_options, created on first use."""
+    global _ytdl
+    if _ytdl is None:
+        yt_dlp = get_yt_dlp()
+        with _ytdl_lock:
+            if _ytdl is None:
+                _ytdl = yt_dlp.YoutubeDL(ytdl_format_options)
+    return _ytdl
+
+ytdl_executor = ThreadPoolExecutor(max_workers=YTDL_WORKERS, thread_name_prefix="ytdl")
+
+# yt-dlp worker threads currently running a job (the queue depth gauge only shows waiting ones)
+_ytdl_busy = 0
+_ytdl_busy_lock = threading.Lock()
+metrics.gauge("musicbot_ytdl_executor_busy_workers", "yt-dlp worker threads running a job", lambda: _ytdl_busy)
+
+async def run_ytdl(func, operation: str, *, loop: Optional[asyncio.AbstractEventLoop] = None,
+                   priority: str = MediaRateLimiter.INTERACTIVE, retries: int = MEDIA_THROTTLE_RETRIES):
+    """
+    Run a blocking yt-dlp call on the yt-dlp worker pool, paced by media_limiter.
+    Calls that hit throttling are retried (after the limiter's backoff) up to `retries` times;
+    the last attempt's result is returned either way.
+    """
+    loop = loop or asyncio.get_event_loop()
+    histogram = ytdl_duration_seconds.labels(operation)
+
+    def job():
+        global _ytdl_busy
+        _ytdl_job_state.throttled = False
+        started = time.perf_counter()
+        with _ytdl_busy_lock:
+            _ytdl_busy += 1
+        try:
+            result = func()
+        except Exception as e:
+            note_ytdl_error(e)
+            raise
+        finally:
+            histogram.observe(time.perf_counter() - started)
+            with _ytdl_busy_lock:
+                _ytdl_busy -= 1
+        throttled = _ytdl_job_state.throttled
+        if not throttled:
+            media_limiter.record_success()
+        return result, throttled
+
+    for attempt in range(retries + 1):
+        await media_limiter.acquire(priority)
+        result, throttled = await loop.run_in_executor(ytdl_executor, job)
+        if not throttled:
+            break
+        if attempt < retries:
+            logger.info(f"Retrying throttled yt-dlp {operation} ({attempt + 1}/{retries})")
+    return result
+
+def prewarm_yt_dlp():
+    """Import yt-dlp and load the YouTube extractor so the first /play doesn't pay for it."""
+    started = time.perf_counter()
+    try:
+        get_ytdl().get_info_extractor("Youtube")
+        logger.info(f"yt-dlp pre-warmed in {time.perf_counter() - started:.2f}s")
+    except Exception as e:
+        logger.warning(f"yt-dlp pre-warm failed: {e}")
 
 URL_RE = re.compile(r'^(https?://)?(www\.)?(youtube\.com|youtu\.be|spotify\.com|soundcloud\.com)')
-PLAYLIST_RE = re.compile(r'(youtube\.com/playlist\?|youtube\.com/watch\?.*&list=|youtu\.be/.*\?list=)')
+PLAYLIST_RE = re.compile(r'(youtube\.com/playlist\?|youtube\.com/watch\?.*&list=|youtu\.be/.*\?list=|soundcloud\.com/[^/?]+/sets/)')
 
 def is_url(s: str) -> bool:
     return bool(URL_RE.match(s))
@@ -107,6 +853,128 @@ def is_playlist_url(s: str) -> bool:
     """Ellenőrzi, hogy a megadott URL lejátszási lista-e"""
     return bool(PLAYLIST_RE.search(s))
 
+# ---------------------- AUDIO FRAME TIMING ----------------------
+FRAME_PERIOD = discord.opus.Encoder.FRAME_LENGTH / 1000  # 20 ms
+FRAME_BYTES = discord.opus.Encoder.FRAME_SIZE
+FRAME_READ_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.04, 0.1)
+
+audio_frame_read_seconds = metrics.histogram(
+    "musicbot_audio_frame_read_seconds", "Time to produce one 20 ms PCM frame", ("guild",), buckets=FRAME_READ_BUCKETS)
+audio_late_frames_total = metrics.counter(
+    "musicbot_audio_late_frames_total", "Frames read more than one frame period behind schedule", ("guild",))
+audio_underruns_total = metrics.counter(
+    "musicbot_audio_underruns_total", "Frames that took longer than a frame period to produce", ("guild",))
+
+class GuildAudioStats:
+    """
+    Frame timing for one guild, written only by its voice thread on every read; the loop thread
+    (track start, pause/resume) just requests a schedule restart that the next read applies.
+    Lifetime totals go to the Prometheus metrics; the last AUDIO_STATS_WINDOW seconds are kept
+    in AUDIO_STATS_SLOTS slots ([start, frames, late, underruns, worst read, bucket counts...])
+    for the worst-guild report. A frame is late when it is read more than one period after its
+    slot on the 20 ms schedule (the voice thread was starved); an underrun is a read that itself
+    took longer than a period (ffmpeg or the pipe couldn't keep up).
+    """
+    def __init__(self, guild_id: int):
+        self.guild_id = guild_id
+        label = str(guild_id)
+        self._read_hist = audio_frame_read_seconds.labels(label)
+        self._late = audio_late_frames_total.labels(label)
+        self._underruns = audio_underruns_total.labels(label)
+        self.slots: deque = deque(maxlen=AUDIO_STATS_SLOTS)
+        self.title: Optional[str] = None
+        self._clock: Optional[float] = None
+        self._frames_on_clock = 0
+        self._clock_reset = False  # set by the loop thread, applied by the voice thread
+
+    def begin_track(self, title: Optional[str]):
+        self.title = title
+        self._clock_reset = True
+
+    def reset_clock(self):
+        """Playback paused/resumed: the schedule restarts at the next read."""
+        self._clock_reset = True
+
+    def record(self, started: float, elapsed: float, size: int):
+        if size == 0:
+            return  # end of track
+        slot = self.slots[-1] if self.slots else None
+        if slot is None or started - slot[0] >= AUDIO_STATS_WINDOW / AUDIO_STATS_SLOTS:
+            slot = [started, 0, 0, 0, 0.0] + [0] * (len(FRAME_READ_BUCKETS) + 1)
+            self.slots.append(slot)
+        if self._clock_reset:
+            self._clock_reset = False
+            self._clock = None
+        if self._clock is None:
+            # Első frame: ffmpeg indulás, nem ütemezési hiba
+            self._clock = started
+            self._frames_on_clock = 0
+            return
+        self._frames_on_clock += 1
+        lag = started - (self._clock + self._frames_on_clock * FRAME_PERIOD)
+        if lag > FRAME_PERIOD:
+            slot[2] += 1
+            self._late.inc()
+        elif lag < -FRAME_PERIOD:
+            self._clock = started  # the sender restarted its own schedule
+            self._frames_on_clock = 0
+        slot[1] += 1
+        if elapsed > FRAME_PERIOD:
+            slot[3] += 1
+            self._underruns.inc()
+        if elapsed > slot[4]:
+            slot[4] = elapsed
+        slot[5 + bisect.bisect_left(FRAME_READ_BUCKETS, elapsed)] += 1
+        self._read_hist.observe(elapsed)
+
+    def window(self) -> Optional[dict]:
+        """Aggregate of the rolling window, or None if no frames were read in it."""
+        cutoff = time.perf_counter() - AUDIO_STATS_WINDOW
+        slots = [s for s in list(self.slots) if s[0] >= cutoff]
+        frames = sum(s[1] for s in slots)
+        if not frames:
+            return None
+        buckets = [sum(s[5 + i] for s in slots) for i in range(len(FRAME_READ_BUCKETS) + 1)]
+        p99_bound = float("inf")
+        seen = 0
+        for bound, count in zip(FRAME_READ_BUCKETS + (float("inf"),), buckets):
+            seen += count
+            if seen >= frames * 0.99:
+                p99_bound = bound
+                break
+        return {
+            "frames": frames,
+            "late": sum(s[2] for s in slots),
+            "underruns": sum(s[3] for s in slots),
+            "worst_read": max(s[4] for s in slots),
+            "p99_read_le": p99_bound,
+        }
+
+audio_stats: Dict[int, GuildAudioStats] = {}
+
+def get_audio_stats(guild_id: int) -> GuildAudioStats:
+    stats = audio_stats.get(guild_id)
+    if stats is None:
+        stats = audio_stats[guild_id] = GuildAudioStats(guild_id)
+    return stats
+
+def audio_jitter_summary(limit: int = 3) -> List[str]:
+    """Worst guilds of the last window (late + underrun share), with the load they coincided with."""
+    rows = []
+    for guild_id, stats in list(audio_stats.items()):
+        w = stats.window()
+        if w and (w["late"] or w["underruns"]):
+            rows.append(((w["late"] + w["underruns"]) / w["frames"], guild_id, stats.title, w))
+    rows.sort(key=lambda r: r[0], reverse=True)
+    load = (f"ytdl busy={_ytdl_busy}/{YTDL_WORKERS} queued={ytdl_executor._work_queue.qsize()} "
+            f"transcodes={len(_transcode_procs)} media tokens={media_limiter.available():.1f}")
+    return [
+        f"[Guild {guild_id}] '{title}' frames={w['frames']} late={w['late']} ({share:.1%}) "
+        f"underruns={w['underruns']} p99 read<={w['p99_read_le'] * 1000:.1f}ms "
+        f"worst={w['worst_read'] * 1000:.1f}ms | {load}"
+        for share, guild_id, title, w in rows[:limit]
+    ]
+
 # ---------------------- YTDL SOURCE (with safe cleanup) ----------------------
 class YTDLSource(discord.PCMVolumeTransformer):
     def __init__(self, source: discord.AudioSource, *, data: dict, filepath: Optional[str] = None, volume: float = 0.5):
@@ -118,22 +986,78 @@ class YTDLSource(discord.PCMVolumeTransformer):
         self.duration = data.get("duration", 0)
         self.filepath = filepath
         self.start_time: Optional[float] = None
+        self.paused_at: Optional[float] = None
+        self.paused_total: float = 0.0
+        self.playlist_title: Optional[str] = None
+        self.requested_at: Optional[float] = None  # perf_counter() of the /play that asked for it
+        self.cleaned_up: bool = False
+        self.cache_key: Optional[str] = None  # video id when the file is managed by track_cache
+        self.resume_offset: float = 0.0  # playback started this far into the track
+        self.frame_stats: Optional[GuildAudioStats] = None  # set when handed to a voice client
+        _live_sources.add(self)
         logger.debug = logger.debug
 
+    def read(self) -> bytes:
+        started = time.perf_counter()
+        data = super().read()
+        if self.frame_stats is not None:
+            self.frame_stats.record(started, time.perf_counter() - started, len(data))
+        if self.requested_at is not None:
+            play_to_first_audio_seconds.observe(time.perf_counter() - self.requested_at)
+            self.requested_at = None
+        return data
+
+    def start_at(self, offset: float):
+        """Begin playback `offset` seconds in (only before the first read)."""
+        if isinstance(self.original, DeferredAudioSource) and not self.original.started:
+            self.original.start = offset
+            self.resume_offset = offset
+
+    def mark_paused(self):
+        """Remember when playback was paused so the progress bar stops advancing."""
+        if self.paused_at is None:
+            self.paused_at = datetime.now().timestamp()
+
+    def mark_resumed(self):
+        """Fold the finished pause into paused_total."""
+        if self.paused_at is not None:
+            self.paused_total += datetime.now().timestamp() - self.paused_at
+            self.paused_at = None
+        if self.frame_stats is not None:
+            self.frame_stats.reset_clock()
+
     @classmethod
     async def from_url(cls, query: str, *, loop: Optional[asyncio.AbstractEventLoop] = None, download: bool = True):
         """Extract info and optionally download. Returns YTDLSource with local filepath (if downloaded)."""
         loop = loop or asyncio.get_event_loop()
+        video_id = video_id_from_url(query) if download else None
+        if video_id:
+            # Egyszerre csak egy letöltés videónként (pl. spekulatív prefetch közben)
+            async with track_cache.lock_for(video_id), shared_cache.single_flight(video_id):
+                return await cls._from_url(query, loop=loop, download=download)
+        return await cls._from_url(query, loop=loop, download=download)
+
+    @classmethod
+    async def _from_url(cls, query: str, *, loop: asyncio.AbstractEventLoop, download: bool):
+        cached = await cache_lookup(video_id_from_url(query)) if download else None
+        if cached and cached.filepath:
+            logger.info(f"Cache hit for: {query}")
+            return track_cache.open_source(cached)
         logger.info(f"Extracting info for: {query} (download={download})")
+        resolved = track_cache.claim_metadata(cached) if cached else None
 
         def extract():
             try:
-                return ytdl.extract_info(query, download=download)
+                if resolved:
+                    # Már feloldott metaadat: csak letöltés, új kinyerés nélkül
+                    return get_ytdl().process_ie_result(resolved, download=True)
+                return get_ytdl().extract_info(query, download=download)
             except Exception as e:
+                note_ytdl_error(e)
                 logger.error(f"yt-dlp extraction error for {query}: {e}")
                 return None
 
-        data = await loop.run_in_executor(None, extract)
+        data = await run_ytdl(extract, "extract" if not download else "download", loop=loop)
         if data is None:
             raise RuntimeError("yt-dlp failed to extract data")
 
@@ -141,16 +1065,17 @@ class YTDLSource(discord.PCMVolumeTransformer):
         if "entries" in data and not data.get("_type") == "playlist":
             data = data["entries"][0]
 
-        filepath = None
         if download:
-            filepath = ytdl.prepare_filename(data)
+            filepath = get_ytdl().prepare_filename(data)
             logger.info(f"Downloaded to: {filepath}")
-            audio_source = discord.FFmpegPCMAudio(filepath, executable="ffmpeg", **ffmpeg_options)
-        else:
-            source_url = data.get("url")
-            audio_source = discord.FFmpegPCMAudio(source_url, executable="ffmpeg", **ffmpeg_options)
+            filepath = await shared_cache.publish_download(data, filepath)
+            entry = track_cache.store(data, filepath)
+            if entry is not None:
+                return track_cache.open_source(entry)
+            return cls(DeferredAudioSource(filepath), data=data, filepath=filepath)
 
-        return cls(audio_source, data=data, filepath=filepath)
+        source_url = data.get("url")
+        return cls(open_pcm_source(source_url), data=data)
 
     @classmethod
     async def extract_playlist_info(cls, url: str, *, loop: Optional[asyncio.AbstractEventLoop] = None):
@@ -170,13 +1095,14 @@ class YTDLSource(discord.PCMVolumeTransformer):
                 opts['extract_flat'] = 'in_playlist'  # csak alapvető infó
                 opts['ignoreerrors'] = True  # hibák esetén folytassa
                 
-                temp_ytdl = youtube_dl.YoutubeDL(opts)
+                temp_ytdl = get_yt_dlp().YoutubeDL(opts)
                 return temp_ytdl.extract_info(url, download=False)
             except Exception as e:
+                note_ytdl_error(e)
                 logger.error(f"Playlist extraction error for {url}: {e}")
                 return None
 
-        data = await loop.run_in_executor(None, extract)
+        data = await run_ytdl(extract, "playlist", loop=loop)
         if data is None:
             raise RuntimeError("Failed to extract playlist data")
 
@@ -246,8 +1172,54 @@ class YTDLSource(discord.PCMVolumeTransformer):
         except Exception as e:
             logger.debug(f"Exception while closing ffmpeg: {e}")
 
+    def adopt_transcoded(self, new_path: str):
+        """Switch to a transcoded copy if playback hasn't started yet; otherwise drop the copy."""
+        audio = self.original
+        if self.cleaned_up or not isinstance(audio, DeferredAudioSource):
+            _unlink_quietly(new_path)
+            return
+        if shared_cache.owns(self.filepath):
+            safe_create_task(self._adopt_shared_transcode(new_path))
+            return
+        if not self._swap_file(new_path):
+            _unlink_quietly(new_path)
+
+    def _swap_file(self, new_path: str) -> bool:
+        """Local part of adopting a copy: swap under the open lock, then delete the old file."""
+        old_path = self.filepath
+        if not self.original.swap_location(new_path, lambda: track_cache.replace_path(self, new_path)):
+            return False
+        self.filepath = new_path
+        if old_path and old_path != new_path:
+            _unlink_quietly(old_path)
+        return True
+
+    async def _adopt_shared_transcode(self, new_path: str):
+        """
+        Shared file: the index is pointed at the copy first (on the shared cache executor,
+        never under the open lock), then the local swap follows.
+        """
+        entry = track_cache.entries.get(self.cache_key) if self.cache_key else None
+        if entry is None or entry.refs > 1 or entry.filepath != self.filepath or self.original.started:
+            _unlink_quietly(new_path)
+            return
+        try:
+            accepted = await shared_cache.run(shared_cache.replace_file, entry.video_id, new_path)
+        except Exception as e:
+            logger.warning(f"Shared cache refused transcoded file for {entry.video_id}: {e}")
+            accepted = False
+        if not accepted:
+            _unlink_quietly(new_path)  # another instance may be playing the old file
+            return
+        if not self.cleaned_up and self._swap_file(new_path):
+            return
+        # Playback started meanwhile: other instances get the copy from the index; the old
+        # file, unindexed now, is already open in ffmpeg and left to maintain()
+        logger.debug(f"Transcoded copy of {entry.video_id} indexed, but playback already started")
+
     async def async_cleanup(self, *, wait: float = 0.2):
         """Async-safe cleanup: close ffmpeg handles, wait a bit, then delete the downloaded file if present."""
+        self.cleaned_up = True
         try:
             self._close_ffmpeg_process()
         except Exception as e:
@@ -258,6 +1230,9 @@ class YTDLSource(discord.PCMVolumeTransformer):
         except Exception:
             pass
 
+        if self.filepath and track_cache.release(self):
+            return
+
         if self.filepath:
             try:
                 p = Path(self.filepath)
@@ -267,6 +1242,638 @@ class YTDLSource(discord.PCMVolumeTransformer):
             except Exception as e:
                 logger.error(f"Failed to delete file {self.filepath}: {e}")
 
+# ---------------------- TRACK CACHE ----------------------
+YOUTUBE_ID_RE = re.compile(r'(?:youtube\.com/(?:watch\?(?:.*&)?v=|shorts/)|youtu\.be/)([\w-]{11})')
+
+def video_id_from_url(url: Optional[str]) -> Optional[str]:
+    if not url:
+        return None
+    m = YOUTUBE_ID_RE.search(url)
+    return m.group(1) if m else None
+
+class CachedTrack:
+    __slots__ = ("video_id", "info", "filepath", "size", "refs", "speculative", "created")
+
+    def __init__(self, video_id: str, info: dict, filepath: Optional[str], speculative: bool):
+        self.video_id = video_id
+        self.info = info
+        self.filepath = filepath
+        self.size = 0
+        self.refs = 0
+        self.speculative = speculative
+        self.created = time.monotonic()
+
+class TrackCache:
+    """
+    Resolved metadata and downloaded files by video id, shared by /play, playlist loading
+    and speculative prefetch. Files used by a YTDLSource are reference counted; when the last
+    user lets go the file is kept while the cache is under AUDIO_CACHE_MAX_BYTES (LRU),
+    otherwise deleted as before. Speculative entries live until claimed or SPECULATIVE_TTL;
+    other metadata-only entries until PLAYLIST_INFO_TTL or past TRACK_CACHE_MAX_METADATA (LRU).
+    """
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[str, CachedTrack]" = OrderedDict()
+        self._paths: Dict[str, str] = {}  # resolved file path -> video id
+        # One download per video id at a time; locks vanish once nobody holds or waits on them
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+    def lock_for(self, video_id: str) -> asyncio.Lock:
+        lock = self._locks.get(video_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._locks[video_id] = lock
+        return lock
+
+    def lookup(self, video_id: Optional[str]) -> Optional[CachedTrack]:
+        entry = self.entries.get(video_id) if video_id else None
+        if entry is None:
+            return None
+        if entry.filepath and not Path(entry.filepath).exists():
+            self._set_path(entry, None)
+        self.entries.move_to_end(video_id)
+        return entry
+
+    def store(self, info: dict, filepath: Optional[str], *, speculative: bool = False) -> Optional[CachedTrack]:
+        video_id = info.get("id")
+        if not video_id:
+            return None
+        entry = self.entries.get(video_id)
+        if entry is None:
+            entry = self.entries[video_id] = CachedTrack(video_id, info, None, speculative)
+        else:
+            entry.info = info
+            entry.created = time.monotonic()
+        if filepath:
+            self._set_path(entry, filepath)
+        self.entries.move_to_end(video_id)
+        # The caller opens the new entry right away (same loop step); it must survive until then
+        self._evict(keep=entry)
+        return entry
+
+    def _set_path(self, entry: CachedTrack, filepath: Optional[str]):
+        if entry.filepath:
+            self._paths.pop(str(Path(entry.filepath).resolve()), None)
+        entry.filepath = filepath
+        entry.size = 0
+        if filepath:
+            self._paths[str(Path(filepath).resolve())] = entry.video_id
+            try:
+                entry.size = Path(filepath).stat().st_size
+            except OSError:
+                pass
+
+    def open_source(self, entry: CachedTrack) -> "YTDLSource":
+        """New YTDLSource playing the entry's file; holds a reference until its async_cleanup."""
+        if entry.speculative:
+            entry.speculative = False
+            speculative_prefetch_total.labels("hit_file").inc()
+        entry.refs += 1
+        source = YTDLSource(DeferredAudioSource(entry.filepath), data=entry.info, filepath=entry.filepath)
+        source.cache_key = entry.video_id
+        return source
+
+    def claim_metadata(self, entry: CachedTrack) -> dict:
+        """Resolved info for a download; counts a speculative metadata hit."""
+        if entry.speculative:
+            entry.speculative = False
+            speculative_prefetch_total.labels("hit_metadata").inc()
+        return dict(entry.info)
+
+    def release(self, source: "YTDLSource") -> bool:
+        """Drop a source's reference. True if the cache manages its file (caller must not delete it)."""
+        entry = self.entries.get(source.cache_key) if source.cache_key else None
+        if entry is None or not entry.filepath or entry.filepath != source.filepath:
+            return False
+        entry.refs = max(entry.refs - 1, 0)
+        if entry.refs == 0 and self.max_bytes <= 0:
+            self._drop(entry)
+        else:
+            self._evict()
+        return True
+
+    def replace_path(self, source: "YTDLSource", new_path: str) -> bool:
+        """Point an entry at a transcoded file; refused while other sources use the old one."""
+        entry = self.entries.get(source.cache_key) if source.cache_key else None
+        if entry is None or entry.filepath != source.filepath:
+            return True
+        if entry.refs > 1:
+            return False
+        self._set_path(entry, new_path)
+        return True
+
+    def owns(self, path: Path) -> bool:
+        return str(path.resolve()) in self._paths
+
+    def shared_video_ids(self) -> List[str]:
+        return [e.video_id for e in self.entries.values() if shared_cache.owns(e.filepath)]
+
+    def total_bytes(self) -> int:
+        return sum(e.size for e in self.entries.values() if not e.speculative)
+
+    def speculative_bytes(self) -> int:
+        return sum(e.size for e in self.entries.values() if e.speculative)
+
+    def expire_speculative(self):
+        now = time.monotonic()
+        for entry in [e for e in self.entries.values() if e.speculative and now - e.created > SPECULATIVE_TTL]:
+            speculative_prefetch_total.labels("wasted").inc()
+            speculative_wasted_bytes_total.inc(entry.size)
+            self._drop(entry)
+        # Resolved stream URLs go stale; such metadata is no use after PLAYLIST_INFO_TTL
+        for entry in [e for e in self.entries.values()
+                      if not e.filepath and not e.speculative and now - e.created > PLAYLIST_INFO_TTL]:
+            self._drop(entry)
+
+    def _drop(self, entry: CachedTrack):
+        self.entries.pop(entry.video_id, None)
+        if shared_cache.owns(entry.filepath):
+            # Shared files are deleted by the shared tier's eviction, once nobody leases them
+            self._set_path(entry, None)
+            shared_cache.release_soon(entry.video_id)
+            return
+        if entry.filepath:
+            path = entry.filepath
+            self._set_path(entry, None)
+            _unlink_quietly(path)
+            logger.info(f"Deleted downloaded file: {path}")
+
+    def save(self, path: Path):
+        """Shutdown: record the cached files (LRU order) so the next process can reuse them."""
+        for entry in [e for e in self.entries.values() if e.speculative]:
+            self._drop(entry)  # unclaimed suggestions are not worth keeping across a restart
+        records = [
+            {"info": compact_info(e.info), "filepath": e.filepath}
+            for e in self.entries.values()
+            if e.filepath and not shared_cache.owns(e.filepath)
+        ]
+        tmp = path.with_name(path.name + ".tmp")
+        try:
+            tmp.write_text(json.dumps(records), encoding="utf-8")
+            os.replace(tmp, path)
+        except Exception as e:
+            logger.error(f"Failed to store track cache index: {e}")
+
+    def load(self, path: Path):
+        """Adopt the files a previous process left cached; without a budget they are left to orphan cleanup."""
+        if self.max_bytes <= 0:
+            return
+        try:
+            records = json.loads(path.read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            return
+        for record in records:
+            if record.get("filepath") and Path(record["filepath"]).exists():
+                self.store(record["info"], record["filepath"])
+        if self.entries:
+            logger.info(f"Track cache: reusing {len(self.entries)} files ({self.total_bytes()} bytes)")
+
+    def _evict(self, keep: Optional[CachedTrack] = None):
+        metadata_only = [e for e in self.entries.values() if not e.filepath and not e.speculative and e is not keep]
+        for entry in metadata_only[:max(len(metadata_only) - TRACK_CACHE_MAX_METADATA, 0)]:
+            self._drop(entry)
+        if self.max_bytes <= 0:
+            return
+        total = self.total_bytes()
+        for entry in list(self.entries.values()):
+            if total <= self.max_bytes:
+                break
+            if entry.refs == 0 and not entry.speculative and entry.filepath and entry is not keep:
+                total -= entry.size
+                self._drop(entry)
+
+speculative_prefetch_total = metrics.counter(
+    "musicbot_speculative_prefetch_total", "Speculative prefetches by outcome", ("result",))
+speculative_wasted_bytes_total = metrics.counter(
+    "musicbot_speculative_wasted_bytes_total", "Bytes downloaded speculatively and never played")
+track_cache = TrackCache(AUDIO_CACHE_MAX_BYTES)
+metrics.gauge("musicbot_track_cache_entries", "Entries in the track cache", lambda: len(track_cache.entries))
+metrics.gauge("musicbot_track_cache_bytes", "Bytes of audio held by the track cache", track_cache.total_bytes)
+
+# ---------------------- SHARED CACHE TIER ----------------------
+shared_cache_total = metrics.counter(
+    "musicbot_shared_cache_total", "Shared cache lookups and maintenance by result", ("result",))
+
+class SharedCacheTier:
+    """
+    Audio files and resolved metadata shared between bot processes through SHARED_CACHE_DIR:
+      audio/            published files, named by video id
+      index.sqlite3     WAL-mode index: tracks(video_id, info, filename, size, ...) and
+                        leases(video_id, instance, heartbeat), instances(instance, heartbeat)
+      locks/<id>.lock   flock()ed by whoever is downloading that video (cross-process single-flight)
+      tmp/<instance>/   this instance's DOWNLOAD_DIR; partial downloads never appear in audio/,
+                        and the directory is only swept once its instance stopped heartbeating
+    An instance holds a lease on every shared file its TrackCache references and refreshes the
+    heartbeat periodically. Eviction (LRU over SHARED_CACHE_MAX_BYTES) only deletes files without a
+    live lease, and lease + path lookups run in the same IMMEDIATE transaction as path changes,
+    so nobody is handed a file that is about to disappear. SQLite locking needs a local
+    filesystem: share a docker volume between containers, not an NFS mount.
+    All methods except the async wrappers block. Index operations run in submission order on a
+    single worker, so a lease released by an evicted entry can't overtake a newer checkout.
+    """
+    def __init__(self, root: Optional[Path]):
+        self.enabled = root is not None
+        self.root = root
+        if not self.enabled:
+            return
+        self.audio_dir = root / "audio"
+        self.lock_dir = root / "locks"
+        self.audio_dir.mkdir(parents=True, exist_ok=True)
+        self.lock_dir.mkdir(parents=True, exist_ok=True)
+        self.index_path = root / "index.sqlite3"
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-cache")
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""CREATE TABLE IF NOT EXISTS tracks (
+                video_id TEXT PRIMARY KEY, info TEXT, resolved_at REAL,
+                filename TEXT, size INTEGER DEFAULT 0, last_used REAL)""")
+            db.execute("""CREATE TABLE IF NOT EXISTS leases (
+                video_id TEXT, instance TEXT, heartbeat REAL, PRIMARY KEY (video_id, instance))""")
+            db.execute("CREATE TABLE IF NOT EXISTS instances (instance TEXT PRIMARY KEY, heartbeat REAL)")
+            db.execute("INSERT OR REPLACE INTO instances VALUES (?, ?)", (SHARED_CACHE_INSTANCE, time.time()))
+        if fcntl is None:
+            logger.warning("fcntl unavailable: shared cache downloads are not single-flight across processes")
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.index_path, timeout=10, isolation_level=None)
+        db.execute("PRAGMA busy_timeout=10000")
+        return db
+
+    def owns(self, path: Optional[str]) -> bool:
+        return self.enabled and path is not None and Path(path).parent.resolve() == self.audio_dir.resolve()
+
+    # ----- blocking operations -----
+    def checkout(self, video_id: str) -> Optional["tuple[dict, Optional[str]]"]:
+        """(info, file path or None) for a video, taking a lease if there is a file."""
+        now = time.time()
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            row = db.execute("SELECT info, resolved_at, filename FROM tracks WHERE video_id=?",
+                             (video_id,)).fetchone()
+            if row is None:
+                db.execute("COMMIT")
+                return None
+            info_json, resolved_at, filename = row
+            path = str(self.audio_dir / filename) if filename else None
+            if path and not Path(path).exists():
+                db.execute("UPDATE tracks SET filename=NULL, size=0 WHERE video_id=?", (video_id,))
+                path = None
+            if path:
+                db.execute("INSERT OR REPLACE INTO leases VALUES (?, ?, ?)", (video_id, SHARED_CACHE_INSTANCE, now))
+                db.execute("UPDATE tracks SET last_used=? WHERE video_id=?", (now, video_id))
+            db.execute("COMMIT")
+        finally:
+            db.close()
+        if path is None and now - (resolved_at or 0) > PLAYLIST_INFO_TTL:
+            return None  # stale stream URLs: only useful with a file
+        return json.loads(info_json), path
+
+    def publish(self, info: dict, filepath: str) -> str:
+        """Move a finished download into audio/, index it and lease it. Returns the shared path."""
+        video_id = info["id"]
+        src = Path(filepath)
+        dst = self.audio_dir / src.name
+        now = time.time()
+        size = src.stat().st_size
+        db = self._connect()
+        try:
+            # Row, lease and move in one IMMEDIATE transaction: no other instance sees the row
+            # before the file is in place, and a failed move leaves no row behind
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("INSERT OR REPLACE INTO tracks VALUES (?, ?, ?, ?, ?, ?)",
+                       (video_id, json.dumps(compact_info(info)), info.get("epoch") or now, dst.name, size, now))
+            db.execute("INSERT OR REPLACE INTO leases VALUES (?, ?, ?)", (video_id, SHARED_CACHE_INSTANCE, now))
+            try:
+                os.replace(src, dst)
+            except OSError:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+        finally:
+            db.close()
+        return str(dst)
+
+    def replace_file(self, video_id: str, new_path: str) -> bool:
+        """Point the index at a transcoded file; refused while another instance holds a lease."""
+        cutoff = time.time() - SHARED_CACHE_LEASE_TTL
+        new = Path(new_path)
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            others = db.execute("SELECT COUNT(*) FROM leases WHERE video_id=? AND instance!=? AND heartbeat>?",
+                                (video_id, SHARED_CACHE_INSTANCE, cutoff)).fetchone()[0]
+            if others:
+                db.execute("ROLLBACK")
+                return False
+            db.execute("UPDATE tracks SET filename=?, size=? WHERE video_id=?",
+                       (new.name, new.stat().st_size, video_id))
+            db.execute("COMMIT")
+            return True
+        finally:
+            db.close()
+
+    def release(self, video_id: str):
+        db = self._connect()
+        try:
+            db.execute("DELETE FROM leases WHERE video_id=? AND instance=?", (video_id, SHARED_CACHE_INSTANCE))
+        finally:
+            db.close()
+
+    def heartbeat(self, video_ids: List[str]):
+        """
+        Refresh this instance's leases and restore any for `video_ids` that expired meanwhile.
+        Never deletes: a checkout or publish queued just before this call may hold a lease that
+        the loop's snapshot of the track cache doesn't show yet (release() drops unused ones).
+        """
+        now = time.time()
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("INSERT OR REPLACE INTO instances VALUES (?, ?)", (SHARED_CACHE_INSTANCE, now))
+            db.execute("UPDATE leases SET heartbeat=? WHERE instance=?", (now, SHARED_CACHE_INSTANCE))
+            db.executemany("""INSERT OR IGNORE INTO leases SELECT video_id, ?, ? FROM tracks
+                              WHERE video_id=? AND filename IS NOT NULL""",
+                           [(SHARED_CACHE_INSTANCE, now, vid) for vid in video_ids])
+            db.execute("COMMIT")
+        finally:
+            db.close()
+
+    def maintain(self) -> int:
+        """Expire dead leases, evict unleased files over budget (LRU), sweep unindexed files. Returns files removed."""
+        now = time.time()
+        doomed: List[str] = []
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("DELETE FROM leases WHERE heartbeat<?", (now - SHARED_CACHE_LEASE_TTL,))
+            gone = [r[0] for r in db.execute("SELECT instance FROM instances WHERE heartbeat<? AND instance!=?",
+                                             (now - SHARED_CACHE_LEASE_TTL, SHARED_CACHE_INSTANCE))]
+            db.executemany("DELETE FROM instances WHERE instance=?", [(i,) for i in gone])
+            total = db.execute("SELECT COALESCE(SUM(size), 0) FROM tracks WHERE filename IS NOT NULL").fetchone()[0]
+            if total > SHARED_CACHE_MAX_BYTES:
+                rows = db.execute("""SELECT video_id, filename, size FROM tracks
+                    WHERE filename IS NOT NULL AND video_id NOT IN (SELECT video_id FROM leases)
+                    ORDER BY last_used""").fetchall()
+                for video_id, filename, size in rows:
+                    if total <= SHARED_CACHE_MAX_BYTES:
+                        break
+                    db.execute("UPDATE tracks SET filename=NULL, size=0 WHERE video_id=?", (video_id,))
+                    doomed.append(filename)
+                    total -= size
+            # Metadata without a file is only kept while its stream URLs could still work
+            db.execute("DELETE FROM tracks WHERE filename IS NULL AND resolved_at<?", (now - PLAYLIST_INFO_TTL,))
+            indexed = {r[0] for r in db.execute("SELECT filename FROM tracks WHERE filename IS NOT NULL")}
+            db.execute("COMMIT")
+        finally:
+            db.close()
+        for filename in doomed:
+            _unlink_quietly(str(self.audio_dir / filename))
+        removed = len(doomed)
+        # Files nobody indexed (transcode leftovers, a crash mid-publish)
+        for file in self.audio_dir.iterdir():
+            try:
+                if file.is_file() and file.name not in indexed and now - file.stat().st_mtime > 3600:
+                    file.unlink()
+                    removed += 1
+            except OSError:
+                pass
+        if fcntl is not None:
+            for lock_file in self.lock_dir.glob("*.lock"):
+                try:
+                    if now - lock_file.stat().st_mtime < 3600:
+                        continue
+                    fd = os.open(lock_file, os.O_RDWR)
+                except OSError:
+                    continue
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    lock_file.unlink()
+                except OSError:
+                    pass  # in use
+                finally:
+                    os.close(fd)
+        # Scratch dirs of instances that stopped heartbeating (a live one may be mid-download)
+        for instance in gone:
+            scratch = self.root / "tmp" / instance
+            if scratch.is_dir() and scratch != DOWNLOAD_DIR:
+                for file in scratch.iterdir():
+                    try:
+                        file.unlink()
+                        removed += 1
+                    except OSError:
+                        pass
+                try:
+                    scratch.rmdir()
+                except OSError:
+                    pass
+        if doomed:
+            shared_cache_total.labels("evicted").inc(len(doomed))
+        return removed
+
+    def release_all(self):
+        """Shutdown: drop this instance's leases, registration and scratch dir (nobody else sweeps it then)."""
+        db = self._connect()
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            db.execute("DELETE FROM leases WHERE instance=?", (SHARED_CACHE_INSTANCE,))
+            db.execute("DELETE FROM instances WHERE instance=?", (SHARED_CACHE_INSTANCE,))
+            db.execute("COMMIT")
+        finally:
+            db.close()
+        # Finished downloads are in audio/ and partial ones were removed by the teardown
+        for file in DOWNLOAD_DIR.glob("*"):
+            _unlink_quietly(str(file))
+        try:
+            DOWNLOAD_DIR.rmdir()
+        except OSError as e:
+            logger.warning(f"Could not remove shared cache scratch dir {DOWNLOAD_DIR}: {e}")
+
+    # ----- async helpers -----
+    def run(self, func, *args) -> asyncio.Future:
+        return asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def lookup(self, video_id: Optional[str]) -> Optional["tuple[dict, Optional[str]]"]:
+        if not self.enabled or not video_id:
+            return None
+        hit = await self.run(self.checkout, video_id)
+        shared_cache_total.labels("miss" if hit is None else "hit" if hit[1] else "metadata_hit").inc()
+        return hit
+
+    async def publish_download(self, info: dict, filepath: str) -> str:
+        if not self.enabled or not info.get("id"):
+            return filepath
+        try:
+            path = await self.run(self.publish, info, filepath)
+        except Exception as e:
+            logger.error(f"Failed to publish {filepath} to the shared cache: {e}")
+            return filepath
+        shared_cache_total.labels("published").inc()
+        return path
+
+    def release_soon(self, video_id: str):
+        try:
+            self.run(self.release, video_id)
+        except RuntimeError:
+            pass  # shutting down: release_all() / lease expiry covers it
+
+    def single_flight(self, video_id: Optional[str]) -> "SharedDownloadLock":
+        return SharedDownloadLock(self if self.enabled and fcntl is not None and video_id else None, video_id)
+
+class SharedDownloadLock:
+    """
+    async with: holds locks/<video id>.lock for a download. flock is only ever tried
+    non-blocking and retried every SHARED_LOCK_POLL, so waiting for another instance's
+    download occupies no thread.
+    """
+    SHARED_LOCK_POLL = 0.2
+
+    def __init__(self, tier: Optional[SharedCacheTier], video_id: Optional[str]):
+        self.tier = tier
+        self.video_id = video_id
+        self._fd: Optional[int] = None
+
+    def _try_lock(self, path: Path) -> bool:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        try:
+            if os.fstat(fd).st_ino == os.stat(path).st_ino:
+                self._fd = fd
+                return True
+        except FileNotFoundError:
+            pass
+        os.close(fd)  # maintain() removed the lock file meanwhile; lock the new one
+        return False
+
+    async def __aenter__(self):
+        if self.tier is None:
+            return self
+        path = self.tier.lock_dir / f"{self.video_id}.lock"
+        waited = False
+        while not self._try_lock(path):
+            waited = True  # another instance is downloading it: wait for that
+            await asyncio.sleep(self.SHARED_LOCK_POLL)
+        if waited:
+            shared_cache_total.labels("waited").inc()
+        return self
+
+    async def __aexit__(self, *exc):
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        return False
+
+shared_cache = SharedCacheTier(SHARED_CACHE_DIR)
+if shared_cache.enabled:
+    logger.info(f"Shared cache: {SHARED_CACHE_DIR.resolve()} (instance {SHARED_CACHE_INSTANCE})")
+# Eviction while loading may already release shared leases, so this waits for shared_cache
+track_cache.load(TRACK_CACHE_INDEX)
+
+async def cache_lookup(video_id: Optional[str]) -> Optional[CachedTrack]:
+    """Local track cache first, then the shared tier (whose hits are adopted locally)."""
+    cached = track_cache.lookup(video_id)
+    if cached is not None and cached.filepath or not shared_cache.enabled:
+        return cached
+    hit = await shared_cache.lookup(video_id)
+    if hit is None:
+        return cached
+    info, path = hit
+    if path is None and cached is not None:
+        return cached  # no file elsewhere either; keep the local metadata
+    return track_cache.store(info, path)
+
+# ---------------------- DOWNLOAD TRANSCODING ----------------------
+# Downloads arrive in whatever container bestaudio picked (large m4a, sometimes video).
+# Queued tracks are re-encoded in the background to a single Ogg/Opus profile: smaller on
+# disk and cheap to demux/decode at play time. Playback still decodes to PCM because volume
+# control (PCMVolumeTransformer) needs PCM, so this does not enable Opus passthrough.
+transcode_executor = ThreadPoolExecutor(max_workers=TRANSCODE_WORKERS, thread_name_prefix="transcode")
+transcode_duration_seconds = metrics.histogram(
+    "musicbot_transcode_duration_seconds", "Post-download transcode duration",
+    buckets=(0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0))
+transcode_bytes_saved_total = metrics.counter(
+    "musicbot_transcode_bytes_saved_total", "Bytes removed from the download directory by transcoding")
+transcode_total = metrics.counter("musicbot_transcode_total", "Transcode jobs by result", ("result",))
+
+def _unlink_quietly(path: str):
+    try:
+        Path(path).unlink(missing_ok=True)
+    except Exception as e:
+        logger.error(f"Failed to delete file {path}: {e}")
+
+def needs_transcode(data: dict, filepath: Optional[str]) -> bool:
+    """True if the downloaded file isn't already a compact audio-only Opus file."""
+    if not TRANSCODE_AUDIO or not filepath:
+        return False
+    ext = Path(filepath).suffix.lstrip(".").lower()
+    if ext == TRANSCODE_EXT:
+        return False
+    audio_only = data.get("vcodec") in (None, "none")
+    if audio_only and data.get("acodec") == "opus" and ext in ("webm", "ogg"):
+        return False
+    return True
+
+# Running ffmpeg transcodes, so a shutdown can kill them instead of waiting
+_transcode_procs: set = set()
+
+def transcode_file(src: str) -> Optional[str]:
+    """Re-encode `src` to Ogg/Opus next to it. Blocking; runs on transcode_executor."""
+    dst = Path(src).with_suffix(f".{TRANSCODE_EXT}")
+    tmp = dst.with_name(dst.name + ".part")
+    started = time.perf_counter()
+    cmd = [
+        "ffmpeg", "-nostdin", "-y", "-loglevel", "error",
+        "-i", src, "-vn", "-map_metadata", "-1",
+        "-c:a", "libopus", "-b:a", TRANSCODE_BITRATE, "-f", "ogg", str(tmp),
+    ]
+    try:
+        proc = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        _transcode_procs.add(proc)
+        try:
+            _, stderr = proc.communicate(timeout=TRANSCODE_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.communicate()
+            raise RuntimeError(f"timed out after {TRANSCODE_TIMEOUT}s")
+        finally:
+            _transcode_procs.discard(proc)
+        if proc.returncode != 0:
+            raise RuntimeError(stderr.decode("utf-8", "replace").strip()[:200])
+        os.replace(tmp, dst)
+    except Exception as e:
+        _unlink_quietly(str(tmp))
+        transcode_total.labels("failed").inc()
+        logger.warning(f"Transcode failed for {src}: {e}")
+        return None
+    transcode_duration_seconds.observe(time.perf_counter() - started)
+    transcode_total.labels("ok").inc()
+    try:
+        transcode_bytes_saved_total.inc(max(Path(src).stat().st_size - dst.stat().st_size, 0))
+    except OSError:
+        pass
+    return str(dst)
+
+def schedule_transcode(source: YTDLSource):
+    """Queue a background transcode for a track that is waiting in a queue."""
+    if not needs_transcode(source.data, source.filepath):
+        transcode_total.labels("skipped").inc()
+        return
+    future = asyncio.get_event_loop().run_in_executor(transcode_executor, transcode_file, source.filepath)
+
+    def _done(fut: asyncio.Future):
+        if fut.cancelled() or fut.exception() is not None:
+            return
+        new_path = fut.result()
+        if new_path:
+            source.adopt_transcoded(new_path)
+
+    future.add_done_callback(_done)
+
 # ---------------------- MUSIC PLAYER (per guild) ----------------------
 class MusicPlayer:
     def __init__(self, guild_id: int):
@@ -276,12 +1883,14 @@ class MusicPlayer:
         self.volume: float = 0.5
         self.text_channel_id: Optional[int] = None
         self.is_loading_playlist: bool = False  # NEW: flag to track playlist loading
-        self.stop_loading: bool = False  # NEW: flag to signal stop
+        self.panel = NowPlayingPanel(guild_id)
+        self.engine = TrackTransitionEngine(guild_id)
         logger.info(f"Created MusicPlayer for guild {guild_id}")
 
     def add(self, source: YTDLSource):
         self.queue.append(source)
         logger.info(f"[Guild {self.guild_id}] Queued: {source.title} (queue size {len(self.queue)})")
+        schedule_transcode(source)
 
     def next(self) -> Optional[YTDLSource]:
         """Get next track. Note: doesn't perform cleanup here."""
@@ -290,7 +1899,7 @@ class MusicPlayer:
     async def clear_queue(self):
         """Clear queue and schedule async cleanup for all queued items and current."""
         logger.info(f"[Guild {self.guild_id}] Clearing queue ({len(self.queue)} items)")
-        self.stop_loading = True  # NEW: signal to stop any ongoing playlist loading
+        self.engine.reset()  # also invalidates the load token of any ongoing playlist loading
         tasks = []
         while self.queue:
             item = self.queue.popleft()
@@ -300,9 +1909,7 @@ class MusicPlayer:
             self.current = None
         if tasks:
             await asyncio.gather(*tasks, return_exceptions=True)
-        # Reset the flag after a short delay
-        await asyncio.sleep(0.5)
-        self.stop_loading = False
+        self.panel.request_update()
 
 players: Dict[int, MusicPlayer] = {}
 
@@ -326,7 +1933,7 @@ def format_time(seconds: int) -> str:
         return f"{hours:02d}:{minutes:02d}:{secs:02d}"
     return f"{minutes:02d}:{secs:02d}"
 
-def create_progress_bar(current: int, total: int, length: int = 20) -> str:
+def create_progress_bar(current: int, total: int, length: int = PROGRESS_BAR_LENGTH) -> str:
     """Create an ASCII progress bar."""
     if total <= 0:
         return f"`[{'─' * length}]` {format_time(current)} / LIVE"
@@ -344,34 +1951,39 @@ def get_current_playback_time(player: MusicPlayer, voice_client) -> int:
     
     now = datetime.now()
     start = datetime.fromtimestamp(player.current.start_time)
-    elapsed = (now - start).total_seconds()
-    return int(elapsed)
+    elapsed = (now - start).total_seconds() - player.current.paused_total + player.current.resume_offset
+    if player.current.paused_at is not None:
+        elapsed -= now.timestamp() - player.current.paused_at
+    return max(int(elapsed), 0)
 
 # ---------------------- BUTTONS UI ----------------------
 class MusicControls(discord.ui.View):
-    def __init__(self, guild_id: int):
+    """
+    Playback buttons shared by every guild.
+    The buttons have stable custom_ids and the handlers resolve the guild from the interaction,
+    so one instance registered with bot.add_view serves every message, including ones sent
+    before a restart.
+    """
+    def __init__(self):
         super().__init__(timeout=None)
-        self.guild_id = guild_id
 
     async def _get_vc(self, interaction: Interaction):
         return interaction.guild.voice_client
 
-    @discord.ui.button(label="⏸ Pause", style=discord.ButtonStyle.gray)
-    async def pause(self, interaction: Interaction, button: discord.ui.Button):
+    @discord.ui.button(label="⏸ Pause", style=discord.ButtonStyle.gray, custom_id="music_controls:pause")
+    async def pause_button(self, interaction: Interaction, button: discord.ui.Button):
         vc = await self._get_vc(interaction)
-        if vc and vc.is_playing():
-            vc.pause()
+        if get_player(interaction.guild.id).engine.pause(vc):
             await interaction.response.send_message("⏸ Paused", ephemeral=True)
         else:
             await interaction.response.send_message("Nothing is playing.", ephemeral=True)
 
-    @discord.ui.button(label="▶️ Resume", style=discord.ButtonStyle.green)
-    async def resume(self, interaction: Interaction, button: discord.ui.Button):
+    @discord.ui.button(label="▶️ Resume", style=discord.ButtonStyle.green, custom_id="music_controls:resume")
+    async def resume_button(self, interaction: Interaction, button: discord.ui.Button):
         vc = await self._get_vc(interaction)
         player = get_player(interaction.guild.id)
         
-        if vc and vc.is_paused():
-            vc.resume()
+        if player.engine.resume(vc):
             await interaction.response.send_message("▶️ Resumed", ephemeral=True)
         elif vc and not vc.is_playing() and len(player.queue) > 0:
             # Special case: nothing playing but queue has songs
@@ -380,8 +1992,8 @@ class MusicControls(discord.ui.View):
         else:
             await interaction.response.send_message("Nothing to resume.", ephemeral=True)
 
-    @discord.ui.button(label="⏭ Skip", style=discord.ButtonStyle.blurple)
-    async def skip(self, interaction: Interaction, button: discord.ui.Button):
+    @discord.ui.button(label="⏭ Skip", style=discord.ButtonStyle.blurple, custom_id="music_controls:skip")
+    async def skip_button(self, interaction: Interaction, button: discord.ui.Button):
         vc = await self._get_vc(interaction)
         player = get_player(interaction.guild.id)
         if vc and (vc.is_playing() or vc.is_paused()):
@@ -391,8 +2003,8 @@ class MusicControls(discord.ui.View):
         else:
             await interaction.response.send_message("Nothing to skip.", ephemeral=True)
 
-    @discord.ui.button(label="⏹ Stop", style=discord.ButtonStyle.red)
-    async def stop(self, interaction: Interaction, button: discord.ui.Button):
+    @discord.ui.button(label="⏹ Stop", style=discord.ButtonStyle.red, custom_id="music_controls:stop")
+    async def stop_button(self, interaction: Interaction, button: discord.ui.Button):
         vc = await self._get_vc(interaction)
         player = get_player(interaction.guild.id)
         if vc:
@@ -402,20 +2014,198 @@ class MusicControls(discord.ui.View):
         else:
             await interaction.response.send_message("Not connected.", ephemeral=True)
 
+# Registered once at startup; receives every button click, whatever message it came from
+music_controls: Optional[MusicControls] = None
+# Stopped copy attached to outgoing messages. discord.py only stores unfinished views per message,
+# so attaching this one sends the same buttons without growing the view store.
+_controls_layout: Optional[MusicControls] = None
+
+def register_persistent_views():
+    """Register the shared MusicControls view. Must run inside the event loop (setup_hook)."""
+    global music_controls, _controls_layout
+    if music_controls is None:
+        music_controls = MusicControls()
+        bot.add_view(music_controls)
+        _controls_layout = MusicControls()
+        _controls_layout.stop()
+        logger.info("Registered persistent music controls view")
+
+def controls_view() -> MusicControls:
+    """Buttons to attach to a message; clicks are handled by the registered persistent view."""
+    if _controls_layout is None:
+        register_persistent_views()
+    return _controls_layout
+
+# ---------------------- NOW PLAYING PANEL ----------------------
+def build_now_playing_embed(player: MusicPlayer, vc) -> discord.Embed:
+    """Render the Now Playing embed from the player's current state."""
+    if not player.current:
+        return discord.Embed(title="Now Playing", description="Queue ended.", color=0x2F3136)
+
+    description = f"**{player.current.title}**"
+    if player.current.playlist_title:
+        description += f"\n\n📋 From playlist: *{player.current.playlist_title}*"
+    embed = discord.Embed(title="Now Playing", description=description, color=0x1DB954)
+
+    current_time = get_current_playback_time(player, vc)
+    embed.add_field(name="Progress", value=create_progress_bar(current_time, player.current.duration), inline=False)
+    status = "⏸ Paused" if vc and vc.is_paused() else "▶️ Playing"
+    embed.add_field(name="Status", value=status, inline=True)
+    embed.add_field(name="Volume", value=f"{int(player.volume * 100)}%", inline=True)
+    embed.add_field(name="Up Next", value=f"{len(player.queue)} in queue", inline=True)
+
+    if player.current.uploader:
+        embed.set_footer(text=f"From {player.current.uploader}")
+    return embed
+
+def progress_refresh_interval(duration: int) -> float:
+    """Refresh roughly once per progress bar cell, bounded so short tracks don't spam edits."""
+    if not duration or duration <= 0:
+        return NOW_PLAYING_MAX_REFRESH
+    per_cell = duration / PROGRESS_BAR_LENGTH
+    return min(max(per_cell, NOW_PLAYING_MIN_REFRESH), NOW_PLAYING_MAX_REFRESH)
+
+class RouteRateLimiter:
+    """
+    Per-route pacing for Discord REST calls.
+    Message sends/edits share a bucket per channel, so the route key is the channel.
+    discord.py already retries on 429 internally; a call that comes back slowly means it
+    waited on the bucket, so the window for that route is widened and shrinks back on fast calls.
+    """
+    def __init__(self, default_window: float, max_window: float):
+        self.default_window = default_window
+        self.max_window = max_window
+        self._windows: Dict[str, float] = {}
+        self._next_allowed: Dict[str, float] = {}
+
+    def delay_for(self, route: str) -> float:
+        return max(0.0, self._next_allowed.get(route, 0.0) - time.monotonic())
+
+    async def wait(self, route: str):
+        delay = self.delay_for(route)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def record(self, route: str, *, elapsed: float = 0.0, retry_after: Optional[float] = None):
+        """Record a finished call on a route and compute when the next one may go out."""
+        window = self._windows.get(route, self.default_window)
+        if retry_after:
+            window = min(max(window * 2, retry_after), self.max_window)
+        elif elapsed > 1.0:
+            window = min(window * 2, self.max_window)
+        else:
+            window = max(window * 0.75, self.default_window)
+        self._windows[route] = window
+        self._next_allowed[route] = time.monotonic() + max(window, retry_after or 0.0)
+
+    def forget(self, route: str):
+        self._windows.pop(route, None)
+        self._next_allowed.pop(route, None)
+
+message_rate_limiter = RouteRateLimiter(NOW_PLAYING_EDIT_WINDOW, NOW_PLAYING_MAX_EDIT_WINDOW)
+
+class NowPlayingPanel:
+    """
+    One persistent Now Playing message per guild, edited in place.
+    State changes only mark the panel dirty; a single flush task renders the latest state
+    once the channel route allows it, so bursts of skips collapse into one API call.
+    """
+    def __init__(self, guild_id: int):
+        self.guild_id = guild_id
+        self.message: Optional[discord.Message] = None
+        self._dirty: bool = False
+        self._flush_task: Optional[asyncio.Task] = None
+        self._ticker_task: Optional[asyncio.Task] = None
+
+    def request_update(self):
+        """Mark the panel stale; coalesced with any other pending update."""
+        self._dirty = True
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = safe_create_task(self._flush())
+
+    def start_ticker(self):
+        """Start the live progress refresher if it isn't already running."""
+        if self._ticker_task is None or self._ticker_task.done():
+            self._ticker_task = safe_create_task(self._tick())
+
+    def stop(self):
+        for task in (self._flush_task, self._ticker_task):
+            if task and not task.done():
+                task.cancel()
+        self._flush_task = None
+        self._ticker_task = None
+
+    async def _tick(self):
+        player = get_player(self.guild_id)
+        while player.current:
+            await asyncio.sleep(progress_refresh_interval(player.current.duration))
+            guild = bot.get_guild(self.guild_id)
+            vc = guild.voice_client if guild else None
+            if player.current and vc and vc.is_playing():
+                self.request_update()
+
+    async def _flush(self):
+        player = get_player(self.guild_id)
+        while self._dirty:
+            channel = bot.get_channel(player.text_channel_id) if player.text_channel_id else None
+            if channel is None:
+                self._dirty = False
+                return
+            route = f"channel:{channel.id}"
+            await message_rate_limiter.wait(route)
+            # Everything marked dirty up to here is covered by this one call
+            self._dirty = False
+            guild = bot.get_guild(self.guild_id)
+            embed = build_now_playing_embed(player, guild.voice_client if guild else None)
+            await self._publish(channel, route, embed)
+
+    async def _publish(self, channel, route: str, embed: discord.Embed):
+        started = time.monotonic()
+        try:
+            if self.message is not None and self.message.channel.id == channel.id:
+                try:
+                    await self.message.edit(embed=embed)
+                except discord.NotFound:
+                    self.message = None
+            if self.message is None or self.message.channel.id != channel.id:
+                self.message = await channel.send(embed=embed, view=controls_view())
+            message_rate_limiter.record(route, elapsed=time.monotonic() - started)
+        except discord.HTTPException as e:
+            retry_after = getattr(e, "retry_after", None)
+            message_rate_limiter.record(route, elapsed=time.monotonic() - started, retry_after=retry_after)
+            logger.error(f"[Guild {self.guild_id}] Error updating now playing message: {e}")
+        except Exception as e:
+            logger.error(f"[Guild {self.guild_id}] Error updating now playing message: {e}")
+
 # ---------------------- AUTOCOMPLETE HELPER ----------------------
+# query -> (expires_at, choices); insertion order doubles as LRU order
+_autocomplete_cache: "OrderedDict[str, tuple]" = OrderedDict()
+_autocomplete_hits = autocomplete_cache_total.labels("hit")
+_autocomplete_misses = autocomplete_cache_total.labels("miss")
+
 async def yt_autocomplete(current: str) -> List[app_commands.Choice[str]]:
-    if not current.strip():
+    if not current.strip() or shutdown.draining:
         return []
-    loop = asyncio.get_event_loop()
+    started = time.perf_counter()
+    key = current.strip().lower()
+    cached = _autocomplete_cache.get(key)
+    if cached and cached[0] > started:
+        _autocomplete_cache.move_to_end(key)
+        _autocomplete_hits.inc()
+        autocomplete_latency_seconds.observe(time.perf_counter() - started)
+        return cached[1]
+    _autocomplete_misses.inc()
 
     def do_search():
         try:
-            return ytdl.extract_info(f"ytsearch5:{current}", download=False)
-        except Exception:
+            return get_ytdl().extract_info(f"ytsearch5:{current}", download=False)
+        except Exception as e:
+            note_ytdl_error(e)
             return None
 
-    data = await loop.run_in_executor(None, do_search)
+    data = await run_ytdl(do_search, "search")
     if not data or "entries" not in data:
+        autocomplete_latency_seconds.observe(time.perf_counter() - started)
         return []
     results = data["entries"][:5]
     choices: List[app_commands.Choice[str]] = []
@@ -423,72 +2213,673 @@ async def yt_autocomplete(current: str) -> List[app_commands.Choice[str]]:
         title = track.get("title", "Unknown")
         url = track.get("webpage_url") or track.get("url") or title
         choices.append(app_commands.Choice(name=title[:100], value=url))
+
+    _autocomplete_cache[key] = (time.perf_counter() + AUTOCOMPLETE_CACHE_TTL, choices)
+    _autocomplete_cache.move_to_end(key)
+    while len(_autocomplete_cache) > AUTOCOMPLETE_CACHE_SIZE:
+        _autocomplete_cache.popitem(last=False)
+    autocomplete_latency_seconds.observe(time.perf_counter() - started)
     return choices
 
-# ---------------------- PLAYBACK HELPERS ----------------------
-async def _play_next_for_guild(guild_id: int):
-    """Advance to next track for a guild, scheduling cleanup of previous track after playback ends."""
-    player = get_player(guild_id)
-    guild = bot.get_guild(guild_id)
-    if guild is None:
-        logger.warning(f"Guild {guild_id} not found when advancing")
-        return
-    vc = guild.voice_client
-    text_channel = None
-    if player.text_channel_id:
-        text_channel = bot.get_channel(player.text_channel_id)
-
-    next_source = player.next()
-    prev = player.current
-    if next_source is None:
-        player.current = None
-        logger.info(f"[Guild {guild_id}] Queue ended")
-        if text_channel:
+class SpeculativePrefetcher:
+    """
+    Resolves (and optionally downloads) the top autocomplete suggestion before the user
+    submits /play, once it has stayed on top for SPECULATIVE_SETTLE. Strictly best effort:
+    at most SPECULATIVE_MAX_PER_GUILD fetches in flight per guild, bulk priority with no
+    retries, and nothing is started while the media limiter is backing off or short on
+    tokens. Results land in track_cache as speculative entries.
+    """
+    def __init__(self):
+        self._inflight: Dict[int, set] = {}
+        self._pending: Dict[int, asyncio.TimerHandle] = {}
+
+    def suggest(self, guild_id: Optional[int], url: str):
+        """Called on every keystroke; only the suggestion the user settles on gets fetched."""
+        if not SPECULATIVE_PREFETCH or guild_id is None or not video_id_from_url(url):
+            return
+        pending = self._pending.pop(guild_id, None)
+        if pending:
+            pending.cancel()
+        loop = asyncio.get_running_loop()
+        self._pending[guild_id] = loop.call_later(SPECULATIVE_SETTLE, self._start, guild_id, url)
+
+    def _start(self, guild_id: int, url: str):
+        self._pending.pop(guild_id, None)
+        video_id = video_id_from_url(url)
+        if video_id in track_cache.entries or track_cache.lock_for(video_id).locked():
+            return
+        inflight = self._inflight.setdefault(guild_id, set())
+        if len(inflight) >= SPECULATIVE_MAX_PER_GUILD or any(video_id in s for s in self._inflight.values()):
+            speculative_prefetch_total.labels("rejected").inc()
+            return
+        if (media_limiter.breaker_open() or time.monotonic() < media_limiter.backoff_until
+                or media_limiter.available() < 2):
+            speculative_prefetch_total.labels("rejected").inc()
+            return
+        download = SPECULATIVE_DOWNLOAD and track_cache.speculative_bytes() < SPECULATIVE_MAX_BYTES
+        inflight.add(video_id)
+        speculative_prefetch_total.labels("started").inc()
+        safe_create_task(self._fetch(guild_id, video_id, url, download))
+
+    async def _fetch(self, guild_id: int, video_id: str, url: str, download: bool):
+        def fetch():
+            opts = ytdl_format_options.copy()
+            opts["noplaylist"] = True
+            opts["max_filesize"] = SPECULATIVE_MAX_FILESIZE
             try:
-                await text_channel.send("Queue ended.")
-            except Exception:
-                pass
-        if prev:
-            safe_create_task(prev.async_cleanup())
-        return
+                ydl = get_yt_dlp().YoutubeDL(opts)
+                info = ydl.extract_info(url, download=download)
+                if not info or "entries" in info:
+                    return None, None
+                filepath = ydl.prepare_filename(info) if download else None
+                return info, filepath
+            except Exception as e:
+                note_ytdl_error(e)
+                return None, None
+
+        try:
+            async with track_cache.lock_for(video_id), shared_cache.single_flight(video_id):
+                if video_id in track_cache.entries or await cache_lookup(video_id):
+                    return
+                info, filepath = await run_ytdl(fetch, "speculative", priority=MediaRateLimiter.BULK, retries=0)
+                if info is None:
+                    return
+                if filepath and not Path(filepath).exists():
+                    filepath = None  # max_filesize felett: csak a metaadat marad meg
+                if filepath:
+                    filepath = await shared_cache.publish_download(info, filepath)
+                track_cache.store(info, filepath, speculative=True)
+                logger.info(f"[Guild {guild_id}] Prefetched {video_id} (file={'yes' if filepath else 'no'})")
+        except Exception as e:
+            logger.debug(f"[Guild {guild_id}] Speculative prefetch of {video_id} failed: {e}")
+        finally:
+            self._inflight.get(guild_id, set()).discard(video_id)
 
-    player.current = next_source
-    player.current.volume = player.volume
-    player.current.start_time = datetime.now().timestamp()
-    logger.info(f"[Guild {guild_id}] Now playing: {player.current.title}")
+speculative_prefetcher = SpeculativePrefetcher()
 
-    def _after_play(error):
-        if error:
-            logger.error(f"[Guild {guild_id}] Playback error: {error}")
-        if prev:
-            safe_create_task(prev.async_cleanup())
-        fut = asyncio.run_coroutine_threadsafe(_play_next_for_guild(guild_id), bot.loop)
+# ---------------------- CATALOG RESOLVER ----------------------
+SPOTIFY_RE = re.compile(r'open\.spotify\.com/(?:intl-[\w-]+/)?(playlist|album|track)/([A-Za-z0-9]+)')
+
+def is_catalog_url(s: str) -> bool:
+    return bool(SPOTIFY_RE.search(s))
+
+class CatalogTrack:
+    __slots__ = ("catalog_id", "title", "artists", "duration")
+
+    def __init__(self, catalog_id: str, title: str, artists: List[str], duration: Optional[float]):
+        self.catalog_id = catalog_id
+        self.title = title
+        self.artists = artists
+        self.duration = duration
+
+    @property
+    def query(self) -> str:
+        return f"{', '.join(self.artists)} - {self.title}" if self.artists else self.title
+
+_WORD_RE = re.compile(r"\w+")
+# Variants a catalog track almost never means, unless its own title says so
+MATCH_PENALTY_WORDS = ("live", "cover", "remix", "karaoke", "instrumental", "reaction",
+                       "nightcore", "slowed", "sped", "8d", "acoustic", "tutorial")
+
+def _words(text: str) -> set:
+    return set(_WORD_RE.findall(text.lower()))
+
+def score_match(track: CatalogTrack, candidate: dict) -> float:
+    """
+    How likely a search result is the catalog track. Title word coverage (0..1), +0.5 if an
+    artist appears, duration agreement up to +0.3, -0.5 per unwanted variant (live, cover...).
+    """
+    title = candidate.get("title") or ""
+    uploader = candidate.get("uploader") or candidate.get("channel") or ""
+    wanted = _words(track.title)
+    found = _words(f"{title} {uploader}")
+    if not wanted:
+        return 0.0
+    score = len(wanted & found) / len(wanted)
+    if any(_words(artist) and _words(artist) <= found for artist in track.artists):
+        score += 0.5
+    if uploader.endswith(" - Topic"):
+        score += 0.2  # YouTube Music auto-generated upload: the studio recording
+    title_words = _words(title)
+    for word in MATCH_PENALTY_WORDS:
+        if word in title_words and word not in wanted:
+            score -= 0.5
+    duration = candidate.get("duration")
+    if track.duration and duration:
+        diff = abs(float(duration) - track.duration)
+        if diff <= 3:
+            score += 0.3
+        elif diff <= 10:
+            score += 0.1
+        elif diff > 30:
+            score -= 0.5
+    return score
+
+class CatalogMap:
+    """catalog track id -> YouTube video id, persisted so a track is only ever searched once."""
+    SAVE_DELAY = 2.0
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._data: Optional[Dict[str, str]] = None
+        self._save_handle: Optional[asyncio.TimerHandle] = None
+
+    def _entries(self) -> Dict[str, str]:
+        if self._data is None:
+            try:
+                self._data = json.loads(self.path.read_text(encoding="utf-8"))
+            except (FileNotFoundError, ValueError):
+                self._data = {}
+        return self._data
+
+    def get(self, catalog_id: str) -> Optional[str]:
+        return self._entries().get(catalog_id)
+
+    def put(self, catalog_id: str, video_id: str):
+        self._entries()[catalog_id] = video_id
+        # Egy playlist feloldása sok put-ot jelent: egyben írjuk ki
+        if self._save_handle is None:
+            self._save_handle = asyncio.get_running_loop().call_later(self.SAVE_DELAY, self.save)
+
+    def save(self):
+        self._save_handle = None
+        if self._data is None:
+            return
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        try:
+            tmp.write_text(json.dumps(self._data), encoding="utf-8")
+            os.replace(tmp, self.path)
+        except Exception as e:
+            logger.error(f"Failed to store catalog map: {e}")
+
+class SpotifyClient:
+    """Minimal Spotify Web API client (client credentials flow) for playlist/album/track listings."""
+    API = "https://api.spotify.com/v1"
+    TOKEN_URL = "https://accounts.spotify.com/api/token"
+
+    def __init__(self, client_id: Optional[str], client_secret: Optional[str]):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._token: Optional[str] = None
+        self._token_expires = 0.0
+
+    @property
+    def configured(self) -> bool:
+        return bool(self.client_id and self.client_secret)
+
+    async def close(self):
+        """Close the HTTP session (shutdown); a later request opens a new one."""
+        session, self._session = self._session, None
+        self._token = None  # bound to the old session's lifetime: fetch a fresh one with the new session
+        if session is not None and not session.closed:
+            await session.close()
+
+    async def _access_token(self) -> str:
+        if self._token and time.monotonic() < self._token_expires:
+            return self._token
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=15))
+        auth = aiohttp.BasicAuth(self.client_id, self.client_secret)
+        async with self._session.post(self.TOKEN_URL, data={"grant_type": "client_credentials"}, auth=auth) as resp:
+            resp.raise_for_status()
+            body = await resp.json()
+        self._token = body["access_token"]
+        self._token_expires = time.monotonic() + body.get("expires_in", 3600) - 60
+        return self._token
+
+    async def _get(self, url: str) -> dict:
+        for _ in range(3):
+            token = await self._access_token()
+            async with self._session.get(url, headers={"Authorization": f"Bearer {token}"}) as resp:
+                if resp.status == 429:
+                    await asyncio.sleep(min(float(resp.headers.get("Retry-After", "1")), 30.0))
+                    continue
+                if resp.status == 401:
+                    self._token = None
+                    continue
+                resp.raise_for_status()
+                return await resp.json()
+        raise RuntimeError(f"Spotify API kept refusing {url}")
+
+    @staticmethod
+    def parse_track(item: Optional[dict]) -> Optional[CatalogTrack]:
+        if not item or not item.get("id") or item.get("is_local"):
+            return None
+        duration_ms = item.get("duration_ms")
+        return CatalogTrack(
+            f"spotify:track:{item['id']}",
+            item.get("name") or "",
+            [a.get("name") for a in item.get("artists") or [] if a.get("name")],
+            duration_ms / 1000 if duration_ms else None,
+        )
+
+    async def _paged(self, url: Optional[str], *, wrapped: bool) -> List[CatalogTrack]:
+        tracks: List[CatalogTrack] = []
+        while url and len(tracks) < CATALOG_MAX_TRACKS:
+            page = await self._get(url)
+            for item in page.get("items") or []:
+                track = self.parse_track(item.get("track") if wrapped else item)
+                if track:
+                    tracks.append(track)
+            url = page.get("next")
+        return tracks[:CATALOG_MAX_TRACKS]
+
+    async def fetch(self, url: str) -> "tuple[str, List[CatalogTrack]]":
+        """(title, tracks) for a Spotify playlist, album or track URL."""
+        kind, item_id = SPOTIFY_RE.search(url).groups()
+        if kind == "track":
+            data = await self._get(f"{self.API}/tracks/{item_id}")
+            track = self.parse_track(data)
+            return data.get("name") or "Spotify track", [track] if track else []
+        if kind == "album":
+            data = await self._get(f"{self.API}/albums/{item_id}")
+            tracks = await self._paged(f"{self.API}/albums/{item_id}/tracks?limit=50", wrapped=False)
+            return data.get("name") or "Spotify album", tracks
+        data = await self._get(f"{self.API}/playlists/{item_id}?fields=name")
+        tracks = await self._paged(
+            f"{self.API}/playlists/{item_id}/tracks?limit=100"
+            f"&fields=next,items(track(id,name,duration_ms,is_local,artists(name)))",
+            wrapped=True,
+        )
+        return data.get("name") or "Spotify playlist", tracks
+
+catalog_resolve_total = metrics.counter(
+    "musicbot_catalog_resolve_total", "Catalog track resolutions by outcome", ("result",))
+
+class CatalogResolver:
+    """
+    Turns catalog tracks into YouTube video URLs: the persistent map first, otherwise one
+    bulk-priority search per track, at most CATALOG_RESOLVE_CONCURRENCY at a time so a
+    500-track playlist never floods the yt-dlp executor. Concurrent requests for the same
+    track (e.g. two guilds queueing the same playlist) share one search; the search is
+    cancelled once every waiter has been cancelled (e.g. /stop on the only guild loading it).
+    """
+    def __init__(self, mapping: CatalogMap, concurrency: int):
+        self.mapping = mapping
+        self._semaphore = asyncio.Semaphore(max(concurrency, 1))
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[str, int] = {}  # resolve() calls awaiting each in-flight search
+        self._unmatched: set = set()  # csak erre a futásra: a katalógus később bővülhet
+
+    def resolve_all(self, tracks: List[CatalogTrack], first_priority: str) -> List[asyncio.Task]:
+        """Start resolving every track now; tasks complete with a video URL or None, in any order."""
+        return [
+            asyncio.ensure_future(self.resolve(track, first_priority if i == 0 else MediaRateLimiter.BULK))
+            for i, track in enumerate(tracks)
+        ]
+
+    async def resolve(self, track: CatalogTrack, priority: str = MediaRateLimiter.BULK) -> Optional[str]:
+        video_id = self.mapping.get(track.catalog_id)
+        if video_id:
+            catalog_resolve_total.labels("cached").inc()
+            return f"https://www.youtube.com/watch?v={video_id}"
+        if track.catalog_id in self._unmatched:
+            catalog_resolve_total.labels("unmatched").inc()
+            return None
+        task = self._inflight.get(track.catalog_id)
+        if task is None:
+            task = asyncio.ensure_future(self._search(track, priority))
+            self._inflight[track.catalog_id] = task
+            task.add_done_callback(lambda _t, key=track.catalog_id: self._inflight.pop(key, None))
+        key = track.catalog_id
+        self._waiters[key] = self._waiters.get(key, 0) + 1
         try:
-            fut.result()
-        except Exception as exc:
-            logger.error(f"[Guild {guild_id}] Error scheduling next track: {exc}")
+            # shield: a cancelled /play must not abort a search another guild is waiting for
+            return await asyncio.shield(task)
+        finally:
+            left = self._waiters[key] - 1
+            if left:
+                self._waiters[key] = left
+            else:
+                del self._waiters[key]
+                if not task.done():
+                    task.cancel()  # nobody is waiting any more
 
-    if vc is None:
-        logger.warning(f"[Guild {guild_id}] Voice client None when trying to play")
-        return
+    async def _search(self, track: CatalogTrack, priority: str) -> Optional[str]:
+        query = track.query
 
-    try:
-        vc.play(player.current, after=_after_play)
-    except Exception as e:
-        logger.error(f"[Guild {guild_id}] Error calling vc.play: {e}")
+        def do_search():
+            try:
+                return get_ytdl().extract_info(f"ytsearch5:{query}", download=False)
+            except Exception as e:
+                note_ytdl_error(e)
+                return None
+
+        async with self._semaphore:
+            data = await run_ytdl(do_search, "catalog_search", priority=priority)
+        candidates = [c for c in (data or {}).get("entries") or [] if c and c.get("id")]
+        best = max(candidates, key=lambda c: score_match(track, c), default=None)
+        if best is None or score_match(track, best) < CATALOG_MATCH_THRESHOLD:
+            logger.info(f"No confident match for '{query}'")
+            catalog_resolve_total.labels("unmatched").inc()
+            if data is not None:
+                self._unmatched.add(track.catalog_id)
+            return None
+        catalog_resolve_total.labels("searched").inc()
+        self.mapping.put(track.catalog_id, best["id"])
+        return f"https://www.youtube.com/watch?v={best['id']}"
+
+spotify_client = SpotifyClient(SPOTIFY_CLIENT_ID, SPOTIFY_CLIENT_SECRET)
+catalog_resolver = CatalogResolver(CatalogMap(CATALOG_MAP_FILE), CATALOG_RESOLVE_CONCURRENCY)
+
+# ---------------------- PLAYLIST SNAPSHOTS ----------------------
+PLAYLIST_ID_RE = re.compile(r'[?&]list=([\w-]+)')
+
+# Reasons from safe_extract_video that won't fix themselves within a day
+PERMANENT_UNAVAILABLE_REASONS = {
+    "Copyright restriction", "Video unavailable", "Private video", "Video removed",
+    "Geographic restriction", "Age restriction", "Members-only content",
+}
+# Bulky yt-dlp fields that aren't needed to download the chosen format again
+_SNAPSHOT_DROP_KEYS = ("thumbnails", "automatic_captions", "subtitles", "heatmap", "chapters",
+                       "description", "tags", "categories", "requested_formats", "requested_downloads")
+
+def compact_info(info: dict) -> dict:
+    """yt-dlp info trimmed to what process_ie_result needs to re-download the selected format."""
+    compact = {k: v for k, v in info.items() if k not in _SNAPSHOT_DROP_KEYS}
+    chosen = info.get("format_id")
+    if chosen and info.get("formats"):
+        compact["formats"] = [f for f in info["formats"] if f.get("format_id") == chosen]
+    return compact
+
+def moved_entries(old_order: List[str], new_order: List[str]) -> set:
+    """Ids present in both orders that changed relative position (outside the longest kept run)."""
+    old_index = {vid: i for i, vid in enumerate(old_order)}
+    common = [vid for vid in new_order if vid in old_index]
+    # Longest increasing subsequence of old positions = entries that stayed in order
+    tails: List[int] = []
+    tail_ids: List[int] = []
+    parents: List[int] = [-1] * len(common)
+    for i, vid in enumerate(common):
+        pos = bisect.bisect_left(tails, old_index[vid])
+        if pos == len(tails):
+            tails.append(old_index[vid])
+            tail_ids.append(i)
+        else:
+            tails[pos] = old_index[vid]
+            tail_ids[pos] = i
+        parents[i] = tail_ids[pos - 1] if pos else -1
+    kept = set()
+    i = tail_ids[-1] if tail_ids else -1
+    while i >= 0:
+        kept.add(common[i])
+        i = parents[i]
+    return {vid for vid in common if vid not in kept}
+
+playlist_snapshot_entries_total = metrics.counter(
+    "musicbot_playlist_snapshot_entries_total", "Playlist entries by how the snapshot served them", ("result",))
+
+class PlaylistSnapshot:
+    """
+    Last known state of a playlist, stored per playlist id under data/playlists/. Remembers each
+    entry's compact resolved info (reused while PLAYLIST_INFO_TTL holds, skipping extraction)
+    and permanent failures (skipped without a network call until PLAYLIST_UNAVAILABLE_TTL).
+    Snapshots of loads still running are in `active`, so a shutdown can save them.
+    """
+    active: "weakref.WeakSet[PlaylistSnapshot]" = weakref.WeakSet()
+
+    def __init__(self, playlist_id: str, data: Optional[dict] = None):
+        self.playlist_id = playlist_id
+        self.existed = data is not None
+        data = data or {}
+        self.order: List[str] = data.get("order", [])
+        self.entries: Dict[str, dict] = data.get("entries", {})
+
+    @staticmethod
+    def id_for(url: str) -> str:
+        m = PLAYLIST_ID_RE.search(url)
+        return m.group(1) if m else hashlib.sha1(url.encode("utf-8")).hexdigest()[:16]
+
+    @classmethod
+    def load(cls, url: str) -> "PlaylistSnapshot":
+        playlist_id = cls.id_for(url)
+        try:
+            data = json.loads((PLAYLIST_SNAPSHOT_DIR / f"{playlist_id}.json").read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            data = None
+        snapshot = cls(playlist_id, data)
+        cls.active.add(snapshot)
+        return snapshot
+
+    def update_listing(self, entries: List[dict]) -> "tuple[int, int, int]":
+        """Adopt the fresh listing; returns (added, removed, moved) relative to the snapshot."""
+        new_order = [e["id"] for e in entries if e.get("id")]
+        new_ids = set(new_order)
+        old_ids = set(self.order)
+        added = len(new_ids - old_ids)
+        removed = len(old_ids - new_ids)
+        moved = len(moved_entries(self.order, new_order))
+        for vid in old_ids - new_ids:
+            self.entries.pop(vid, None)
+        self.order = new_order
+        return added, removed, moved
+
+    def known_unavailable(self, video_id: Optional[str]) -> Optional[str]:
+        entry = self.entries.get(video_id) if video_id else None
+        if entry and entry.get("unavailable") and time.time() - entry.get("checked_at", 0) < PLAYLIST_UNAVAILABLE_TTL:
+            return entry["unavailable"]
+        return None
+
+    def resolved_info(self, video_id: Optional[str]) -> Optional[dict]:
+        entry = self.entries.get(video_id) if video_id else None
+        if entry and entry.get("info") and time.time() - entry.get("checked_at", 0) < PLAYLIST_INFO_TTL:
+            return entry["info"]
+        return None
+
+    def mark_resolved(self, video_id: Optional[str], info: dict):
+        if video_id:
+            # yt-dlp stamps extraction time in "epoch"; reused info keeps its original age
+            self.entries[video_id] = {"info": compact_info(info), "checked_at": info.get("epoch") or time.time()}
+
+    def mark_failed(self, video_id: Optional[str], reason: str):
+        if video_id and reason in PERMANENT_UNAVAILABLE_REASONS:
+            self.entries[video_id] = {"unavailable": reason, "checked_at": time.time()}
+
+    @staticmethod
+    def expire_old() -> int:
+        """Delete snapshots not saved for PLAYLIST_SNAPSHOT_MAX_AGE. Returns how many were removed."""
+        cutoff = time.time() - PLAYLIST_SNAPSHOT_MAX_AGE
+        removed = 0
+        for path in PLAYLIST_SNAPSHOT_DIR.glob("*.json*"):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+                    removed += 1
+            except OSError:
+                pass
+        return removed
+
+    def save(self):
+        path = PLAYLIST_SNAPSHOT_DIR / f"{self.playlist_id}.json"
+        tmp = path.with_name(path.name + ".tmp")
+        try:
+            tmp.write_text(json.dumps({"order": self.order, "entries": self.entries}), encoding="utf-8")
+            os.replace(tmp, path)
+        except Exception as e:
+            logger.error(f"Failed to store playlist snapshot {self.playlist_id}: {e}")
+
+# ---------------------- TRACK TRANSITIONS ----------------------
+track_transition_seconds = metrics.histogram(
+    "musicbot_track_transition_seconds", "Time taken by track state transitions", ("transition",))
+
+class TrackTransitionEngine:
+    """
+    Per-guild track state machine: idle -> loading -> playing <-> paused -> ending -> loading/idle.
+    The voice thread only posts a track_end event (call_soon_threadsafe, never blocks);
+    commands and playlist ingestion post enqueue/advance. A single worker applies events in
+    order, so skip, stop and queue-end races always resolve the same way.
+    """
+    IDLE = "idle"
+    LOADING = "loading"
+    PLAYING = "playing"
+    PAUSED = "paused"
+    ENDING = "ending"
+
+    def __init__(self, guild_id: int):
+        self.guild_id = guild_id
+        self.state = self.IDLE
+        # Bumped for every started track and on reset; stale track_end events are ignored
+        self._generation = 0
+        # Bumped only on reset: loaders holding an older token must not add tracks any more
+        self.load_token = 0
+        self._events: deque = deque()
+        self._worker: Optional[asyncio.Task] = None
+
+    # --- entry points ---
+    def post(self, kind: str, payload=None, posted_at: Optional[float] = None):
+        """Queue an event for this guild (event loop thread only)."""
+        self._events.append((kind, payload, posted_at or time.perf_counter()))
+        if self._worker is None or self._worker.done():
+            self._worker = safe_create_task(self._run())
+
+    def advance(self):
+        """Start the next queued track if nothing is playing."""
+        self.post("advance")
+
+    async def enqueue(self, source: YTDLSource, load_token: Optional[int] = None) -> str:
+        """
+        Play `source` now if the guild is idle, otherwise queue it. Returns 'playing', 'queued',
+        'failed', or 'stopped' if `load_token` was taken before a reset (the source is cleaned up).
+        """
+        result = asyncio.get_event_loop().create_future()
+        self.post("enqueue", (source, result, load_token))
+        return await result
+
+    def reset(self):
+        """Forget the current track (stop / leave); its pending track_end will be ignored."""
+        self._generation += 1
+        self.load_token += 1
+        self._set_state(self.IDLE, time.perf_counter())
+
+    def pause(self, vc) -> bool:
+        if not (vc and vc.is_playing()):
+            return False
+        started = time.perf_counter()
+        vc.pause()
+        player = get_player(self.guild_id)
+        if player.current:
+            player.current.mark_paused()
+        self._set_state(self.PAUSED, started)
+        player.panel.request_update()
+        return True
+
+    def resume(self, vc) -> bool:
+        if not (vc and vc.is_paused()):
+            return False
+        started = time.perf_counter()
+        vc.resume()
+        player = get_player(self.guild_id)
+        if player.current:
+            player.current.mark_resumed()
+        self._set_state(self.PLAYING, started)
+        player.panel.request_update()
+        return True
+
+    def _after_callback(self, generation: int):
+        loop = bot.loop
+
+        def _after_play(error):
+            # Runs on discord.py's audio thread: hand off and return immediately
+            try:
+                loop.call_soon_threadsafe(self.post, "track_end", (generation, error), time.perf_counter())
+            except RuntimeError:
+                pass  # loop already closed (shutdown)
+
+        return _after_play
+
+    # --- worker ---
+    async def _run(self):
+        while self._events:
+            kind, payload, posted_at = self._events.popleft()
+            try:
+                self._handle(kind, payload, posted_at)
+            except Exception as e:
+                logger.error(f"[Guild {self.guild_id}] Error handling {kind} event: {e}")
+                if kind == "enqueue" and not payload[1].done():
+                    payload[1].set_result("failed")
+
+    def _handle(self, kind: str, payload, posted_at: float):
+        player = get_player(self.guild_id)
+        if kind == "track_end":
+            generation, error = payload
+            after_play_lag_seconds.observe(time.perf_counter() - posted_at)
+            if generation != self._generation:
+                return
+            if error:
+                logger.error(f"[Guild {self.guild_id}] Playback error: {error}")
+            self._set_state(self.ENDING, posted_at)
+            self._advance(player, posted_at)
+        elif kind == "advance":
+            if self.state == self.IDLE:
+                self._advance(player, posted_at)
+        elif kind == "enqueue":
+            source, result, load_token = payload
+            if load_token is not None and load_token != self.load_token:
+                safe_create_task(source.async_cleanup())
+                result.set_result("stopped")
+            elif self.state == self.IDLE and player.current is None:
+                player.queue.appendleft(source)
+                self._advance(player, posted_at)
+                result.set_result("playing" if player.current is source else "failed")
+            else:
+                player.add(source)
+                player.panel.request_update()
+                result.set_result("queued")
+
+    def _advance(self, player: "MusicPlayer", started: float):
+        prev = player.current
+        player.current = None
         if prev:
             safe_create_task(prev.async_cleanup())
-        return
 
-    if text_channel:
+        guild = bot.get_guild(self.guild_id)
+        vc = guild.voice_client if guild else None
+        # Leállításkor a sor megmarad a resume állapothoz, de új dal nem indul
+        next_source = player.next() if not shutdown.draining else None
+        if next_source is None:
+            logger.info(f"[Guild {self.guild_id}] Queue ended")
+            self._set_state(self.IDLE, started)
+            player.panel.request_update()
+            return
+        if vc is None:
+            logger.warning(f"[Guild {self.guild_id}] Voice client None when trying to play")
+            safe_create_task(next_source.async_cleanup())
+            self._set_state(self.IDLE, started)
+            player.panel.request_update()
+            return
+
+        self._set_state(self.LOADING, started)
+        player.current = next_source
+        next_source.volume = player.volume
+        next_source.start_time = datetime.now().timestamp()
+        next_source.frame_stats = get_audio_stats(self.guild_id)
+        next_source.frame_stats.begin_track(next_source.title)
+        self._generation += 1
         try:
-            view = MusicControls(guild_id)
-            embed = discord.Embed(title="Now Playing", description=f"**{player.current.title}**", color=0x1DB954)
-            if player.current.uploader:
-                embed.set_footer(text=f"Requested from {player.current.uploader}")
-            await text_channel.send(embed=embed, view=view)
+            vc.play(next_source, after=self._after_callback(self._generation))
         except Exception as e:
-            logger.error(f"Error sending now playing message: {e}")
+            logger.error(f"[Guild {self.guild_id}] Error calling vc.play: {e}")
+            player.current = None
+            safe_create_task(next_source.async_cleanup())
+            self._set_state(self.IDLE, started)
+            player.panel.request_update()
+            return
+
+        tracks_started_total.inc()
+        logger.info(f"[Guild {self.guild_id}] Now playing: {next_source.title}")
+        self._set_state(self.PLAYING, started)
+        player.panel.request_update()
+        player.panel.start_ticker()
+
+    def _set_state(self, new_state: str, started: float):
+        if new_state != self.state:
+            track_transition_seconds.labels(f"{self.state}->{new_state}").observe(time.perf_counter() - started)
+            self.state = new_state
+
+async def _play_next_for_guild(guild_id: int):
+    """Advance to next track for a guild if it is idle."""
+    get_player(guild_id).engine.advance()
 
 # ---------------------- AUTO LEAVE TASK ----------------------
 @tasks.loop(minutes=1)
@@ -506,16 +2897,41 @@ async def auto_leave_task():
         except Exception as e:
             logger.error(f"Auto-leave error: {e}")
 
+# ---------------------- SHARED CACHE HEARTBEAT TASK ----------------------
+@tasks.loop(seconds=SHARED_CACHE_LEASE_TTL / 4)
+async def shared_cache_heartbeat():
+    """Keep this instance's leases on shared files alive (and restore any that were expired)."""
+    try:
+        await shared_cache.run(shared_cache.heartbeat, track_cache.shared_video_ids())
+    except Exception as e:
+        logger.error(f"Shared cache heartbeat failed: {e}")
+
+# ---------------------- AUDIO JITTER REPORT TASK ----------------------
+@tasks.loop(seconds=max(AUDIO_JITTER_REPORT_INTERVAL, 1.0))
+async def audio_jitter_report():
+    """Log the guilds with the worst frame timing in the last window, next to the extraction load."""
+    lines = audio_jitter_summary()
+    if lines:
+        logger.warning(f"Audio jitter in the last {AUDIO_STATS_WINDOW:.0f}s:\n  " + "\n  ".join(lines))
+
 # ---------------------- ORPHANED FILE CLEANUP TASK ----------------------
 @tasks.loop(minutes=10)
 async def cleanup_orphaned_files():
     """Remove old files from the download folder (older than 1 hour)."""
     try:
-        now = asyncio.get_event_loop().time()
+        track_cache.expire_speculative()
+        expired_snapshots = PlaylistSnapshot.expire_old()
+        if expired_snapshots:
+            logger.info(f"Removed {expired_snapshots} expired playlist snapshots")
+        if shared_cache.enabled:
+            shared_removed = await shared_cache.run(shared_cache.maintain)
+            if shared_removed:
+                logger.info(f"Shared cache maintenance removed {shared_removed} files")
+        now = time.time()  # st_mtime is wall-clock time
         removed = 0
         for file in DOWNLOAD_DIR.iterdir():
             try:
-                if not file.is_file():
+                if not file.is_file() or track_cache.owns(file):
                     continue
                 age = now - file.stat().st_mtime
                 if age > 3600:
@@ -532,6 +2948,187 @@ async def cleanup_orphaned_files():
     except Exception as e:
         logger.error(f"Error in orphan cleanup: {e}")
 
+# ---------------------- GRACEFUL SHUTDOWN ----------------------
+PARTIAL_DOWNLOAD_PATTERNS = ("*.part", "*.part-Frag*", "*.ytdl", "*.temp", "*.tmp")
+
+class GracefulShutdown:
+    """
+    SIGTERM drain for rolling restarts, bounded by SHUTDOWN_DEADLINE:
+    refuse new /play work, let tracks that end within the budget finish, save the remaining
+    positions and queues to RESUME_STATE, cancel queued executor jobs, kill ffmpeg children,
+    remove partial downloads, flush on-disk state and close the bot.
+    """
+    def __init__(self):
+        self.draining = False
+        self.busy_workers = False
+
+    def request(self, reason: str):
+        if not self.draining:
+            safe_create_task(self.drain(reason))
+
+    @staticmethod
+    def _ends_by(player: MusicPlayer, until: float) -> bool:
+        """True if the player's current track is playing and will end before `until`."""
+        source = player.current
+        if source is None or player.engine.state != TrackTransitionEngine.PLAYING or not source.duration:
+            return False
+        remaining = source.duration - get_current_playback_time(player, None)
+        return remaining <= until - time.perf_counter()
+
+    async def drain(self, reason: str):
+        if self.draining:
+            return
+        self.draining = True
+        started = time.perf_counter()
+        deadline = started + SHUTDOWN_DEADLINE
+        logger.info(f"Draining ({reason}): finishing current tracks, deadline {SHUTDOWN_DEADLINE:.0f}s")
+        auto_leave_task.cancel()
+        cleanup_orphaned_files.cancel()
+        audio_jitter_report.cancel()
+        shared_cache_heartbeat.cancel()
+
+        # Tracks about to end may finish; 40% of the budget stays reserved for teardown
+        wait_until = started + SHUTDOWN_DEADLINE * 0.6
+        while time.perf_counter() < wait_until and any(self._ends_by(p, wait_until) for p in players.values()):
+            await asyncio.sleep(0.25)
+
+        try:
+            await asyncio.wait_for(self._teardown(), timeout=max(deadline - time.perf_counter(), 0.5))
+        except asyncio.TimeoutError:
+            logger.warning("Shutdown deadline reached, closing anyway")
+        except Exception as e:
+            logger.error(f"Error during shutdown: {e}")
+        logger.info(f"Drained in {time.perf_counter() - started:.2f}s")
+        await bot.close()
+
+    async def _teardown(self):
+        self.save_resume_state()
+
+        # Queued yt-dlp / transcode jobs are dropped; running ones can't be interrupted
+        ytdl_executor.shutdown(wait=False, cancel_futures=True)
+        transcode_executor.shutdown(wait=False, cancel_futures=True)
+        for proc in list(_transcode_procs):
+            try:
+                proc.kill()
+            except Exception:
+                pass
+
+        for vc in list(bot.voice_clients):
+            try:
+                vc.stop()
+            except Exception:
+                pass
+        for source in list(_live_sources):
+            source._close_ffmpeg_process()
+        for player in list(players.values()):
+            player.panel.stop()
+        await asyncio.gather(*(p.clear_queue() for p in list(players.values())), return_exceptions=True)
+
+        removed = remove_partial_downloads()
+        if removed:
+            logger.info(f"Removed {removed} partial downloads")
+        catalog_resolver.mapping.save()
+        track_cache.save(TRACK_CACHE_INDEX)
+        for snapshot in list(PlaylistSnapshot.active):
+            snapshot.save()
+        await spotify_client.close()
+        if shared_cache.enabled:
+            # Leases go with us; the files stay for the other instances (and our restart)
+            await shared_cache.run(shared_cache.release_all)
+            shared_cache.executor.shutdown(wait=False)
+
+        for vc in list(bot.voice_clients):
+            try:
+                await vc.disconnect(force=True)
+            except Exception:
+                pass
+
+    def save_resume_state(self):
+        guilds = {}
+        for guild_id, player in players.items():
+            guild = bot.get_guild(guild_id)
+            vc = guild.voice_client if guild else None
+            if vc is None or vc.channel is None:
+                continue
+            tracks = []
+            if player.current and player.current.webpage_url:
+                tracks.append({"url": player.current.webpage_url, "title": player.current.title,
+                               "position": get_current_playback_time(player, vc)})
+            tracks += [{"url": s.webpage_url, "title": s.title, "position": 0} for s in player.queue if s.webpage_url]
+            if tracks:
+                guilds[str(guild_id)] = {"voice_channel_id": vc.channel.id, "text_channel_id": player.text_channel_id,
+                                         "volume": player.volume, "tracks": tracks}
+        try:
+            if guilds:
+                tmp = RESUME_STATE.with_name(RESUME_STATE.name + ".tmp")
+                tmp.write_text(json.dumps({"saved_at": time.time(), "guilds": guilds}), encoding="utf-8")
+                os.replace(tmp, RESUME_STATE)
+                logger.info(f"Saved playback state for {len(guilds)} guilds")
+            else:
+                RESUME_STATE.unlink(missing_ok=True)
+        except Exception as e:
+            logger.error(f"Failed to save resume state: {e}")
+
+    async def restore(self):
+        """Re-queue what was playing before the last graceful shutdown, from the saved positions."""
+        try:
+            data = json.loads(RESUME_STATE.read_text(encoding="utf-8"))
+        except (FileNotFoundError, ValueError):
+            return
+        RESUME_STATE.unlink(missing_ok=True)
+        if time.time() - data.get("saved_at", 0) > RESUME_MAX_AGE:
+            logger.info("Resume state too old, ignoring")
+            return
+        await asyncio.gather(*(self._restore_guild(int(gid), state) for gid, state in data.get("guilds", {}).items()),
+                             return_exceptions=True)
+
+    async def _restore_guild(self, guild_id: int, state: dict):
+        guild = bot.get_guild(guild_id)
+        channel = bot.get_channel(state.get("voice_channel_id"))
+        if guild is None or channel is None:
+            return
+        if not any(not getattr(m, "bot", False) for m in channel.members):
+            logger.info(f"[Guild {guild_id}] Nobody left in {channel.name}, not resuming")
+            return
+        if guild.voice_client is None:
+            await channel.connect()
+        player = get_player(guild_id)
+        player.text_channel_id = state.get("text_channel_id")
+        player.volume = state.get("volume", player.volume)
+        load_token = player.engine.load_token
+        restored = 0
+        for i, track in enumerate(state.get("tracks", [])):
+            if self.draining or guild.voice_client is None or player.engine.load_token != load_token:
+                return
+            priority = MediaRateLimiter.INTERACTIVE if i == 0 else MediaRateLimiter.BULK
+            source = await safe_extract_video(track["url"], priority=priority)
+            if source is None:
+                continue
+            if track.get("position"):
+                source.start_at(track["position"])
+            source.volume = player.volume
+            if await player.engine.enqueue(source, load_token) in ("playing", "queued"):
+                restored += 1
+        logger.info(f"[Guild {guild_id}] Resumed {restored} tracks after restart")
+
+    def finish(self):
+        """After the loop stopped: yt-dlp threads still downloading would keep the process alive."""
+        remove_partial_downloads()
+        self.busy_workers = any(t.is_alive() for t in getattr(ytdl_executor, "_threads", ()))
+
+def remove_partial_downloads() -> int:
+    removed = 0
+    for pattern in PARTIAL_DOWNLOAD_PATTERNS:
+        for file in DOWNLOAD_DIR.glob(pattern):
+            try:
+                file.unlink()
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+shutdown = GracefulShutdown()
+
 # ---------------------- SLASH COMMANDS ----------------------
 @tree.command(name="join", description="Make the bot join your voice channel")
 async def join(interaction: Interaction):
@@ -539,7 +3136,7 @@ async def join(interaction: Interaction):
         return await interaction.response.send_message("You must be in a voice channel.", ephemeral=True)
     channel = interaction.user.voice.channel
     await channel.connect()
-    view = MusicControls(interaction.guild_id)
+    view = controls_view()
     await interaction.response.send_message("Joined your voice channel ✅", view=view)
 
 @tree.command(name="leave", description="Disconnect bot from voice channel")
@@ -594,14 +3191,32 @@ def is_video_available(entry: dict) -> tuple[bool, Optional[str]]:
     
     return True, None
 
-async def safe_extract_video(video_url: str, loop: Optional[asyncio.AbstractEventLoop] = None) -> Optional[YTDLSource]:
+async def safe_extract_video(video_url: str, loop: Optional[asyncio.AbstractEventLoop] = None,
+                             priority: str = MediaRateLimiter.INTERACTIVE, *, resolved: Optional[dict] = None,
+                             failures: Optional[Dict[str, str]] = None) -> Optional[YTDLSource]:
     """
     Safely extract and create a YTDLSource, with proper error handling for restricted content.
-    Returns None if video cannot be played.
+    Returns None if video cannot be played (the reason is recorded in `failures` by URL).
+    `resolved` is previously extracted info; extraction is skipped while it still downloads.
     """
     loop = loop or asyncio.get_event_loop()
+    video_id = video_id_from_url(video_url)
+    if video_id:
+        async with track_cache.lock_for(video_id), shared_cache.single_flight(video_id):
+            return await _safe_extract_video(video_url, video_id, loop, priority, resolved, failures)
+    return await _safe_extract_video(video_url, None, loop, priority, resolved, failures)
+
+async def _safe_extract_video(video_url: str, video_id: Optional[str], loop: asyncio.AbstractEventLoop,
+                              priority: str, resolved: Optional[dict],
+                              failures: Optional[Dict[str, str]]) -> Optional[YTDLSource]:
+    cached = await cache_lookup(video_id)
+    if cached and cached.filepath:
+        return track_cache.open_source(cached)
+    if cached:
+        resolved = track_cache.claim_metadata(cached)
     
     def extract_and_download():
+        yt_dlp = get_yt_dlp()
         try:
             # Direktben letöltünk és ellenőrzünk
             # Ha bármilyen hiba van, yt-dlp automatikusan elkapja
@@ -610,8 +3225,16 @@ async def safe_extract_video(video_url: str, loop: Optional[asyncio.AbstractEven
             opts['noplaylist'] = True  # biztosan csak egy videó
             opts['ignoreerrors'] = False  # itt már nem ignoráljuk a hibákat
             
-            temp_ytdl = youtube_dl.YoutubeDL(opts)
-            info = temp_ytdl.extract_info(video_url, download=True)
+            temp_ytdl = yt_dlp.YoutubeDL(opts)
+            info = None
+            if resolved:
+                try:
+                    info = temp_ytdl.process_ie_result(dict(resolved), download=True)
+                except yt_dlp.utils.DownloadError as e:
+                    # Lejárt stream URL: teljes kinyerés újra
+                    logger.debug(f"Reusing resolved info failed for {video_url}: {str(e)[:100]}")
+            if not info:
+                info = temp_ytdl.extract_info(video_url, download=True)
             
             if not info:
                 return None, "Failed to extract info"
@@ -622,9 +3245,11 @@ async def safe_extract_video(video_url: str, loop: Optional[asyncio.AbstractEven
             
             return info, None
             
-        except youtube_dl.utils.DownloadError as e:
+        except yt_dlp.utils.DownloadError as e:
             error_msg = str(e).lower()
-            if "copyright" in error_msg:
+            if note_ytdl_error(error_msg):
+                return None, "Rate limited"
+            elif "copyright" in error_msg:
                 return None, "Copyright restriction"
             elif "not available" in error_msg or "unavailable" in error_msg:
                 return None, "Video unavailable"
@@ -643,7 +3268,7 @@ async def safe_extract_video(video_url: str, loop: Optional[asyncio.AbstractEven
             else:
                 logger.warning(f"Download error for {video_url}: {str(e)[:100]}")
                 return None, "Cannot download"
-        except youtube_dl.utils.ExtractorError as e:
+        except yt_dlp.utils.ExtractorError as e:
             error_msg = str(e).lower()
             if "private" in error_msg:
                 return None, "Private video"
@@ -653,24 +3278,32 @@ async def safe_extract_video(video_url: str, loop: Optional[asyncio.AbstractEven
                 logger.warning(f"Extractor error for {video_url}: {str(e)[:100]}")
                 return None, "Extraction failed"
         except Exception as e:
+            if note_ytdl_error(e):
+                return None, "Rate limited"
             logger.warning(f"Unexpected error for {video_url}: {str(e)[:100]}")
             return None, "Unexpected error"
     
     # Próbáljuk meg letölteni
-    info, error_reason = await loop.run_in_executor(None, extract_and_download)
+    info, error_reason = await run_ytdl(extract_and_download, "download", loop=loop, priority=priority)
     
     if info is None:
         logger.info(f"Skipping video {video_url}: {error_reason}")
+        if failures is not None:
+            failures[video_url] = error_reason
         return None
     
     # Most készítsük el a forrást a letöltött fájlból
     try:
-        filepath = ytdl.prepare_filename(info)
+        filepath = get_ytdl().prepare_filename(info)
         if not Path(filepath).exists():
             logger.error(f"Downloaded file not found: {filepath}")
             return None
+        filepath = await shared_cache.publish_download(info, filepath)
         
-        audio_source = discord.FFmpegPCMAudio(filepath, executable="ffmpeg", **ffmpeg_options)
+        entry = track_cache.store(info, filepath)
+        if entry is not None:
+            return track_cache.open_source(entry)
+        audio_source = DeferredAudioSource(filepath)
         source = YTDLSource(audio_source, data=info, filepath=filepath)
         return source
     except Exception as e:
@@ -680,6 +3313,10 @@ async def safe_extract_video(video_url: str, loop: Optional[asyncio.AbstractEven
 @tree.command(name="play", description="Play a song or playlist from a URL or search terms")
 @app_commands.describe(query="YouTube URL, playlist URL, or search keywords")
 async def play(interaction: Interaction, query: str):
+    requested_at = time.perf_counter()
+    if shutdown.draining:
+        return await interaction.response.send_message(
+            "🔄 The bot is restarting, try again in a few seconds.", ephemeral=True)
     if interaction.user.voice is None:
         return await interaction.response.send_message("You must be in a voice channel.", ephemeral=True)
 
@@ -690,22 +3327,41 @@ async def play(interaction: Interaction, query: str):
     player = get_player(interaction.guild_id)
     player.text_channel_id = interaction.channel_id
 
-    # Ellenőrizzük, hogy lejátszási lista URL-e
-    if is_url(query) and is_playlist_url(query):
+    catalog_url = is_catalog_url(query)
+    if catalog_url and not spotify_client.configured:
+        return await interaction.response.send_message(
+            "❌ Spotify links need SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET to be configured.", ephemeral=True)
+
+    # Ellenőrizzük, hogy lejátszási lista URL-e (a katalógus linkeket is listaként kezeljük)
+    if catalog_url or (is_url(query) and is_playlist_url(query)):
         await interaction.response.send_message("🔎 Loading playlist (this may take a moment)...", ephemeral=True)
         
         # Set loading flag
         player.is_loading_playlist = True
-        player.stop_loading = False
+        entries: List[dict] = []
+        # /stop (or leaving) resets the engine, which invalidates this token
+        load_token = player.engine.load_token
         
         try:
             # Szerezzük meg a lejátszási lista információit
-            playlist_title, entries = await YTDLSource.extract_playlist_info(query, loop=bot.loop)
+            if catalog_url:
+                playlist_title, tracks = await spotify_client.fetch(query)
+                entries = [{"title": t.title, "catalog_track": t} for t in tracks]
+            else:
+                playlist_title, entries = await YTDLSource.extract_playlist_info(query, loop=bot.loop)
+            snapshot = None if catalog_url else PlaylistSnapshot.load(query)
             
             if not entries:
                 player.is_loading_playlist = False
                 return await interaction.followup.send("❌ Playlist is empty or unavailable.", ephemeral=True)
             
+            # A pillanatkép a teljes listát követi, különben a levágott rész "törlésnek" látszana
+            if snapshot is not None:
+                added, removed, moved = snapshot.update_listing(entries)
+                if snapshot.existed:
+                    logger.info(f"[Guild {interaction.guild_id}] Playlist {snapshot.playlist_id} changed: "
+                                f"+{added} -{removed} ~{moved}")
+            
             # Limitáljuk a lejátszási listát (pl. max 50 dal)
             MAX_PLAYLIST_SIZE = 50
             total_videos = len(entries)
@@ -716,26 +3372,42 @@ async def play(interaction: Interaction, query: str):
                 )
                 entries = entries[:MAX_PLAYLIST_SIZE]
             
+            failures: Dict[str, str] = {}
+            
+            if catalog_url:
+                # Az összes dal keresése egyszerre indul, a sorba állítás sorrendben várja őket
+                first_priority = MediaRateLimiter.INTERACTIVE if player.current is None else MediaRateLimiter.BULK
+                resolving = catalog_resolver.resolve_all([e["catalog_track"] for e in entries], first_priority)
+                for entry, task in zip(entries, resolving):
+                    entry["resolving"] = task
+            
             # Első dal lejátszása vagy sorba állítása
             added_count = 0
             skipped_count = 0
-            first_song = True
             skipped_reasons = {}
             
             for i, entry in enumerate(entries, 1):
                 # CHECK: Ha a stop flag be van állítva, állítsuk le a playlist betöltését
-                if player.stop_loading:
+                if player.engine.load_token != load_token or shutdown.draining:
                     logger.info(f"[Guild {interaction.guild_id}] Playlist loading stopped by user at {i}/{len(entries)}")
                     await interaction.followup.send(
                         f"⏹ Playlist loading stopped. Added **{added_count}** songs before stopping.",
                         ephemeral=True
                     )
                     player.is_loading_playlist = False
+                    if snapshot is not None:
+                        snapshot.save()
                     return
                 
                 try:
                     # Videó URL készítése a flat extraction eredményéből
                     video_url = entry.get("url") or entry.get("webpage_url")
+                    if "resolving" in entry:
+                        video_url = await entry["resolving"]
+                        if not video_url:
+                            skipped_count += 1
+                            skipped_reasons["No match"] = skipped_reasons.get("No match", 0) + 1
+                            continue
                     
                     if not video_url:
                         logger.warning(f"No URL for entry {i}, skipping")
@@ -743,52 +3415,55 @@ async def play(interaction: Interaction, query: str):
                         skipped_reasons["No URL"] = skipped_reasons.get("No URL", 0) + 1
                         continue
                     
+                    # Az előző betöltésből ismert, tartósan elérhetetlen videók hálózat nélkül kimaradnak
+                    video_id = entry.get("id")
+                    known_reason = snapshot.known_unavailable(video_id) if snapshot is not None else None
+                    if known_reason:
+                        playlist_snapshot_entries_total.labels("known_unavailable").inc()
+                        skipped_count += 1
+                        skipped_reasons["Restricted or unavailable"] = skipped_reasons.get("Restricted or unavailable", 0) + 1
+                        continue
+                    resolved = snapshot.resolved_info(video_id) if snapshot is not None else None
+                    playlist_snapshot_entries_total.labels("reused" if resolved else "resolved").inc()
+                    
                     # Biztonságos forrás létrehozása (ez most letölt és ellenőriz)
                     # A safe_extract_video már kezeli az összes lehetséges hibát
-                    source = await safe_extract_video(video_url, loop=bot.loop)
+                    # Amíg nincs mit lejátszani, a kérés interaktív; utána a többi dal háttérmunka
+                    priority = MediaRateLimiter.INTERACTIVE if player.current is None else MediaRateLimiter.BULK
+                    source = await safe_extract_video(video_url, loop=bot.loop, priority=priority,
+                                                      resolved=resolved, failures=failures)
                     
                     if source is None:
+                        if snapshot is not None:
+                            snapshot.mark_failed(video_id, failures.get(video_url, ""))
                         skipped_count += 1
                         skipped_reasons["Restricted or unavailable"] = skipped_reasons.get("Restricted or unavailable", 0) + 1
                         continue
+                    if snapshot is not None:
+                        snapshot.mark_resolved(video_id, source.data)
                     
                     source.volume = player.volume
+                    source.playlist_title = playlist_title
                     
-                    # Első dal kezelése
-                    if first_song and not vc.is_playing() and not vc.is_paused() and player.current is None:
-                        player.current = source
-                        player.current.start_time = datetime.now().timestamp()
-                        
-                        def _after_play(err):
-                            if err:
-                                logger.error(f"[Guild {interaction.guild_id}] Playback error: {err}")
-                            fut = asyncio.run_coroutine_threadsafe(_play_next_for_guild(interaction.guild_id), bot.loop)
-                            try:
-                                fut.result()
-                            except Exception as exc:
-                                logger.error(f"Error scheduling next after initial play: {exc}")
-                        
-                        vc.play(source, after=_after_play)
-                        first_song = False
-                        
-                        # "Now Playing" üzenet
-                        view = MusicControls(interaction.guild_id)
-                        embed = discord.Embed(
-                            title="Now Playing",
-                            description=f"**{source.title}**\n\n📋 From playlist: *{playlist_title}*",
-                            color=0x1DB954
-                        )
-                        if source.uploader:
-                            embed.set_footer(text=f"From {source.uploader}")
-                        await interaction.followup.send(embed=embed, view=view)
-                    else:
-                        # Sorba állítás
-                        player.add(source)
+                    # Ha épp semmi sem szól, azonnal indul, különben sorba kerül
+                    if player.current is None:
+                        source.requested_at = requested_at
+                    outcome = await player.engine.enqueue(source, load_token)
+                    if outcome == "stopped":
+                        continue  # stopped while downloading: the next round reports it
+                    if outcome != "playing":
+                        source.requested_at = None
+                    if outcome == "failed":
+                        skipped_count += 1
+                        skipped_reasons["Playback error"] = skipped_reasons.get("Playback error", 0) + 1
+                        continue
                     
                     added_count += 1
                     logger.info(f"Added song {i}/{len(entries)} from playlist: {source.title}")
                     
                 except Exception as e:
+                    if shutdown.draining:
+                        continue  # a leállítás leállította az executort; a következő kör kilép
                     logger.error(f"Error adding song {i}/{len(entries)} from playlist: {e}")
                     skipped_count += 1
                     skipped_reasons["Error"] = skipped_reasons.get("Error", 0) + 1
@@ -796,6 +3471,8 @@ async def play(interaction: Interaction, query: str):
             
             # Reset loading flag
             player.is_loading_playlist = False
+            if snapshot is not None:
+                snapshot.save()
             
             # Részletes összefoglaló üzenet
             if added_count > 0:
@@ -819,6 +3496,11 @@ async def play(interaction: Interaction, query: str):
             player.is_loading_playlist = False
             logger.error(f"[Guild {interaction.guild_id}] Playlist error for '{query}': {e}")
             return await interaction.followup.send("❌ Could not load playlist.", ephemeral=True)
+        finally:
+            # Stop, error or a cancelled interaction: searches nobody will await are dropped
+            for pending in entries:
+                if "resolving" in pending:
+                    pending["resolving"].cancel()
     
     else:
         # Egyedi dal lejátszása (eredeti logika)
@@ -834,53 +3516,42 @@ async def play(interaction: Interaction, query: str):
 
         source.volume = player.volume
 
-        if not vc.is_playing() and not vc.is_paused() and player.current is None:
-            player.current = source
-            player.current.start_time = datetime.now().timestamp()
-
-            def _after_play(err):
-                if err:
-                    logger.error(f"[Guild {interaction.guild_id}] Playback error: {err}")
-                fut = asyncio.run_coroutine_threadsafe(_play_next_for_guild(interaction.guild_id), bot.loop)
-                try:
-                    fut.result()
-                except Exception as exc:
-                    logger.error(f"Error scheduling next after initial play: {exc}")
-
-            try:
-                vc.play(source, after=_after_play)
-            except Exception as e:
-                logger.error(f"Error starting playback: {e}")
-                await interaction.followup.send("❌ Failed to play audio.", ephemeral=True)
-                await source.async_cleanup()
-                return
-
-            view = MusicControls(interaction.guild_id)
-            embed = discord.Embed(title="Now Playing", description=f"**{source.title}**", color=0x1DB954)
-            if source.uploader:
-                embed.set_footer(text=f"From {source.uploader}")
-            await interaction.followup.send(embed=embed, view=view)
-        else:
-            player.add(source)
+        if player.current is None:
+            source.requested_at = requested_at
+        outcome = await player.engine.enqueue(source)
+        if outcome == "playing":
+            await interaction.followup.send(f"▶️ Playing **{source.title}**", ephemeral=True)
+        elif outcome == "queued":
+            source.requested_at = None
             await interaction.followup.send(f"➕ Queued **{source.title}**", ephemeral=True)
+        else:
+            await interaction.followup.send("❌ Failed to play audio.", ephemeral=True)
+
+@play.autocomplete("query")
+async def play_query_autocomplete(interaction: Interaction, current: str) -> List[app_commands.Choice[str]]:
+    if is_url(current.strip()):
+        if not is_playlist_url(current.strip()):
+            speculative_prefetcher.suggest(interaction.guild_id, current.strip())
+        return []
+    choices = await yt_autocomplete(current)
+    if choices:
+        speculative_prefetcher.suggest(interaction.guild_id, choices[0].value)
+    return choices
 
 @tree.command(name="skip", description="Skip current track")
 async def skip(interaction: Interaction):
     vc = interaction.guild.voice_client
     if vc and (vc.is_playing() or vc.is_paused()):
         vc.stop()
-        view = MusicControls(interaction.guild_id)
-        await interaction.response.send_message("⏭ Skipped", view=view)
+        await interaction.response.send_message("⏭ Skipped", ephemeral=True)
     else:
         await interaction.response.send_message("Nothing to skip.", ephemeral=True)
 
 @tree.command(name="pause", description="Pause playback")
 async def pause(interaction: Interaction):
     vc = interaction.guild.voice_client
-    if vc and vc.is_playing():
-        vc.pause()
-        view = MusicControls(interaction.guild_id)
-        await interaction.response.send_message("⏸ Paused", view=view)
+    if get_player(interaction.guild_id).engine.pause(vc):
+        await interaction.response.send_message("⏸ Paused", ephemeral=True)
     else:
         await interaction.response.send_message("Nothing is playing.", ephemeral=True)
 
@@ -889,13 +3560,10 @@ async def resume(interaction: Interaction):
     vc = interaction.guild.voice_client
     player = get_player(interaction.guild_id)
     
-    if vc and vc.is_paused():
-        vc.resume()
-        view = MusicControls(interaction.guild_id)
-        await interaction.response.send_message("▶️ Resumed", view=view)
+    if player.engine.resume(vc):
+        await interaction.response.send_message("▶️ Resumed", ephemeral=True)
     elif vc and not vc.is_playing() and len(player.queue) > 0:
         # Special case: nothing playing but queue has songs
-        # This happens when user skips before next song loads
         logger.info(f"[Guild {interaction.guild_id}] Resume triggered with empty current but non-empty queue")
         await interaction.response.send_message("▶️ Starting playback from queue...", ephemeral=True)
         await _play_next_for_guild(interaction.guild_id)
@@ -947,7 +3615,7 @@ async def show_queue(interaction: Interaction):
                 break
         embed.add_field(name="Up Next", value=desc, inline=False)
     
-    view = MusicControls(interaction.guild_id)
+    view = controls_view()
     await interaction.response.send_message(embed=embed, view=view)
 
 @tree.command(name="volume", description="Set playback volume (0-100)")
@@ -959,8 +3627,8 @@ async def volume_cmd(interaction: Interaction, percent: int):
     player.volume = percent / 100
     if player.current:
         player.current.volume = player.volume
-    view = MusicControls(interaction.guild_id)
-    await interaction.response.send_message(f"🔊 Volume set to **{percent}%**", view=view)
+    player.panel.request_update()
+    await interaction.response.send_message(f"🔊 Volume set to **{percent}%**", ephemeral=True)
 
 @tree.command(name="now", description="Show now playing")
 async def now_cmd(interaction: Interaction):
@@ -968,44 +3636,81 @@ async def now_cmd(interaction: Interaction):
     vc = interaction.guild.voice_client
     
     if player.current:
-        current_time = get_current_playback_time(player, vc)
-        progress = create_progress_bar(current_time, player.current.duration)
-        
-        embed = discord.Embed(title="Now Playing", description=f"**{player.current.title}**", color=0x1DB954)
-        embed.add_field(name="Progress", value=progress, inline=False)
-        
-        if player.current.uploader:
-            embed.set_footer(text=f"From {player.current.uploader}")
-        
-        status = "⏸ Paused" if vc and vc.is_paused() else "▶️ Playing"
-        embed.add_field(name="Status", value=status, inline=True)
-        embed.add_field(name="Volume", value=f"{int(player.volume * 100)}%", inline=True)
-        
-        view = MusicControls(interaction.guild_id)
+        embed = build_now_playing_embed(player, vc)
+        view = controls_view()
         await interaction.response.send_message(embed=embed, view=view)
     else:
         await interaction.response.send_message("Nothing is playing.", ephemeral=True)
 
 # ---------------------- EVENTS / STARTUP ----------------------
-@bot.event
-async def on_ready():
-    logger.info(f"Logged in as {bot.user} (ID: {bot.user.id})")
+def command_tree_hash() -> str:
+    """Stable hash of the slash command payload Discord would receive on sync."""
+    payload = [cmd.to_dict(tree) for cmd in sorted(tree.get_commands(), key=lambda c: c.name)]
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+async def sync_commands_if_changed():
+    """Sync slash commands only when the tree differs from the last successful sync for this application."""
+    app_key = str(bot.application_id)
+    try:
+        state = json.loads(COMMAND_SYNC_STATE.read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError):
+        state = {}
+
+    current_hash = command_tree_hash()
+    if not FORCE_COMMAND_SYNC and state.get(app_key) == current_hash:
+        logger.info("Slash commands unchanged since last sync; skipping sync")
+        return
+
     try:
         synced = await tree.sync()
         logger.info(f"Synced {len(synced)} slash commands")
     except Exception as e:
         logger.error(f"Command sync error: {e}")
-    auto_leave_task.start()
-    cleanup_orphaned_files.start()
+        return
+
+    state[app_key] = current_hash
+    try:
+        COMMAND_SYNC_STATE.write_text(json.dumps(state), encoding="utf-8")
+    except Exception as e:
+        logger.error(f"Failed to store command sync state: {e}")
+
+_ready_once = False
+
+@bot.event
+async def on_ready():
+    # on_ready fires again after every gateway reconnect; startup work must only run once
+    global _ready_once
+    if _ready_once:
+        logger.info("Gateway reconnected")
+        return
+    _ready_once = True
+
+    logger.info(f"Logged in as {bot.user} (ID: {bot.user.id})")
+    await sync_commands_if_changed()
+    if not auto_leave_task.is_running():
+        auto_leave_task.start()
+    if not cleanup_orphaned_files.is_running():
+        cleanup_orphaned_files.start()
+    if AUDIO_JITTER_REPORT_INTERVAL > 0 and not audio_jitter_report.is_running():
+        audio_jitter_report.start()
+    if shared_cache.enabled and not shared_cache_heartbeat.is_running():
+        shared_cache_heartbeat.start()
     logger.info("Background tasks started")
-    logger.info("Bot is ready!")
+    # Egy hirtelen leállás után maradt félkész letöltések
+    removed = remove_partial_downloads()
+    if removed:
+        logger.info(f"Removed {removed} partial downloads left by the previous run")
+    safe_create_task(shutdown.restore())
+    logger.info(f"Bot is ready! Cold start to ready: {time.perf_counter() - _STARTUP_T0:.2f}s")
 
 @bot.event
 async def on_guild_remove(guild):
     logger.info(f"Removed from guild: {guild.name} (ID: {guild.id})")
+    audio_stats.pop(guild.id, None)
     if guild.id in players:
         logger.info(f"Cleaning up player for guild {guild.id}")
         await players[guild.id].clear_queue()
+        players[guild.id].panel.stop()
         del players[guild.id]
 
 # ---------------------- ERROR HANDLING ----------------------
@@ -1014,10 +3719,20 @@ async def on_error(event, *args, **kwargs):
     logger.exception(f"Unhandled error in event {event}")
 
 # ---------------------- RUN ----------------------
-try:
-    logger.info("Starting bot...")
-    bot.run(TOKEN)
-except KeyboardInterrupt:
-    logger.info("Bot stopped by user")
-except Exception as e:
-    logger.critical(f"Fatal error: {e}", exc_info=True)
\ No newline at end of file
+logger.info(f"Module loaded in {time.perf_counter() - _STARTUP_T0:.2f}s")
+
+if __name__ == "__main__":
+    try:
+        logger.info("Starting bot...")
+        bot.run(TOKEN)
+    except KeyboardInterrupt:
+        logger.info("Bot stopped by user")
+    except Exception as e:
+        logger.critical(f"Fatal error: {e}", exc_info=True)
+    if shutdown.draining:
+        shutdown.finish()
+        if shutdown.busy_workers:
+            # A running yt-dlp download can't be cancelled; don't let it hold the restart hostage
+            logger.info("Abandoning in-flight downloads")
+            logging.shutdown()
+            os._exit(0)
@@ -0,0 +1,137 @@
+# bench/catalog.py
+# Offline replay of catalog (Spotify) link resolution against recorded fixtures.
+# Checks score_match picks the expected video for every track, that the persistent catalog map
+# makes a second pass search-free, and reports how many searches ran and how long it took.
+#
+# Usage (from the repository root):
+#     python -m bench.catalog
+#     python -m bench.catalog --fixture bench/fixtures/spotify_playlist.json --search-latency 0.3 --verbose
+#
+# Fixture format: {"url": ..., "spotify": {api url: response}, "searches": {"ytsearch5:...": result},
+#                  "expected": {catalog track id: video id or null}}
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+from bench.harness import REPO_ROOT, install_fake_yt_dlp
+
+DEFAULT_FIXTURE = Path(__file__).resolve().parent / "fixtures" / "spotify_playlist.json"
+
+class FixtureYoutubeDL:
+    """Answers ytsearch queries from the fixture; anything unrecorded is an error."""
+    searches: Dict[str, dict] = {}
+    latency = 0.0
+    calls = 0
+
+    def __init__(self, params: Optional[dict] = None):
+        self.params = dict(params or {})
+
+    def extract_info(self, url: str, download: bool = True, **kwargs):
+        type(self).calls += 1
+        time.sleep(self.latency)
+        if url not in self.searches:
+            raise RuntimeError(f"No recorded search result for {url!r}")
+        return json.loads(json.dumps(self.searches[url]))
+
+async def replay(app, fixture: dict, args) -> dict:
+    spotify_responses = fixture["spotify"]
+
+    class FixtureSpotifyClient(app.SpotifyClient):
+        async def _get(self, url: str) -> dict:
+            if url not in spotify_responses:
+                raise RuntimeError(f"No recorded Spotify response for {url}")
+            return spotify_responses[url]
+
+    client = FixtureSpotifyClient("bench", "bench")
+    title, tracks = await client.fetch(fixture["url"])
+    expected = fixture["expected"]
+
+    async def run_pass(resolver) -> dict:
+        FixtureYoutubeDL.calls = 0
+        started = time.perf_counter()
+        tasks = resolver.resolve_all(tracks, app.MediaRateLimiter.INTERACTIVE)
+        try:
+            urls = await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+        elapsed = time.perf_counter() - started
+        correct = 0
+        mismatches = []
+        for track, url in zip(tracks, urls):
+            got = app.video_id_from_url(url)
+            if got == expected.get(track.catalog_id):
+                correct += 1
+            else:
+                mismatches.append(f"{track.query}: got {got}, expected {expected.get(track.catalog_id)}")
+            if args.verbose:
+                search = fixture["searches"].get(f"ytsearch5:{track.query}", {}).get("entries", [])
+                print(f"{track.query}")
+                for candidate in search:
+                    print(f"    {app.score_match(track, candidate):6.2f}  {candidate['id']}  {candidate['title']}")
+        return {"seconds": elapsed, "searches": FixtureYoutubeDL.calls, "correct": correct, "mismatches": mismatches}
+
+    first = await run_pass(app.catalog_resolver)
+    # Flush the debounced save, then resolve again from a cold process' point of view
+    app.catalog_resolver.mapping.save()
+    fresh = app.CatalogResolver(app.CatalogMap(app.CATALOG_MAP_FILE), app.CATALOG_RESOLVE_CONCURRENCY)
+    second = await run_pass(fresh)
+
+    return {
+        "playlist": title,
+        "tracks": len(tracks),
+        "expected_tracks": len(expected),
+        "first_pass": first,
+        "second_pass": second,
+        "resolve_outcomes": {
+            values[0]: child.value for values, child in app.catalog_resolve_total._children.items()
+        },
+    }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replay catalog link resolution against recorded fixtures")
+    parser.add_argument("--fixture", type=Path, default=DEFAULT_FIXTURE, help="fixture JSON file")
+    parser.add_argument("--search-latency", type=float, default=0.05, help="simulated yt-dlp search latency (s)")
+    parser.add_argument("--verbose", action="store_true", help="print every candidate's score")
+    return parser.parse_args(argv)
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    fixture = json.loads(args.fixture.resolve().read_text(encoding="utf-8"))
+    workdir = tempfile.mkdtemp(prefix="musicbot-catalog-")
+    previous_cwd = os.getcwd()
+    os.chdir(workdir)
+    sys.path.insert(0, str(REPO_ROOT))
+    try:
+        module = install_fake_yt_dlp()
+        FixtureYoutubeDL.searches = fixture["searches"]
+        FixtureYoutubeDL.latency = args.search_latency
+        module.YoutubeDL = FixtureYoutubeDL
+        import logging
+        import app
+
+        if not args.verbose:
+            app.logger.setLevel(logging.WARNING)
+        report = asyncio.run(replay(app, fixture, args))
+        app.ytdl_executor.shutdown(wait=False)
+        print(json.dumps(report, indent=2, ensure_ascii=False))
+        ok = (report["tracks"] == report["expected_tracks"]
+              and report["first_pass"]["correct"] == report["tracks"]
+              and report["second_pass"]["correct"] == report["tracks"]
+              and report["second_pass"]["searches"] <= report["tracks"] - len(
+                  [v for v in fixture["expected"].values() if v]))
+        return 0 if ok else 1
+    finally:
+        os.chdir(previous_cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    sys.exit(main())
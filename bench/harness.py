@@ -0,0 +1,713 @@
+# bench/harness.py
+# Offline benchmark / load test for the music bot.
+# Drives the real MusicPlayer, _play_next_for_guild, /play playlist ingestion and yt_autocomplete
+# for N simulated guilds, with stand-ins for yt-dlp, ffmpeg and the Discord voice client.
+#
+# Usage (from the repository root):
+#     python -m bench.harness --guilds 10 --tracks 8 --track-seconds 2
+#
+# Nothing touches the network: yt-dlp is replaced by a fake module before app.py loads it,
+# audio comes from a synthetic PCM generator, and the voice client consumes frames on a 20 ms clock.
+# discord.py must be installed (app.py imports it), but no token or gateway connection is needed.
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import types
+from pathlib import Path
+from typing import Dict, List, Optional
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+FRAME_SECONDS = 0.02
+FRAME_SIZE = 3840  # 20 ms of 48 kHz stereo s16le, same as discord.opus.Encoder.FRAME_SIZE
+SYNTHETIC_MAGIC = b"BENCHPCM"
+
+# ---------------------- STATS ----------------------
+def percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+    return {
+        "count": len(ordered),
+        "p50": pick(0.50),
+        "p95": pick(0.95),
+        "p99": pick(0.99),
+        "max": ordered[-1],
+    }
+
+class BenchStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.play_requested: Dict[int, float] = {}
+        self.time_to_first_audio: List[float] = []
+        self.inter_track_gaps: List[float] = []
+        self.tracks_finished = 0
+        self.frames = 0
+        self.loop_lag: List[float] = []
+        self.first_playlist_loads: List[float] = []
+        self.repeat_playlist_loads: List[float] = []
+        self.api_calls: Dict[str, int] = {}
+        self._last_end: Dict[int, float] = {}
+
+    def api(self, kind: str):
+        self.api_calls[kind] = self.api_calls.get(kind, 0) + 1
+
+    def first_frame(self, guild_id: int, now: float):
+        with self.lock:
+            requested = self.play_requested.pop(guild_id, None)
+            if requested is not None:
+                self.time_to_first_audio.append(now - requested)
+            last_end = self._last_end.pop(guild_id, None)
+            if last_end is not None:
+                self.inter_track_gaps.append(now - last_end)
+
+    def track_end(self, guild_id: int, now: float, frames: int):
+        with self.lock:
+            self._last_end[guild_id] = now
+            self.tracks_finished += 1
+            self.frames += frames
+
+# ---------------------- SYNTHETIC AUDIO ----------------------
+def write_synthetic_audio(path: str, duration: float):
+    """Stand-in for a downloaded file: a tiny header describing how much audio to synthesize."""
+    header = json.dumps({"duration": duration}).encode("utf-8")
+    with open(path, "wb") as f:
+        f.write(SYNTHETIC_MAGIC + header)
+
+def _read_synthetic_duration(path: str) -> float:
+    with open(path, "rb") as f:
+        raw = f.read()
+    if not raw.startswith(SYNTHETIC_MAGIC):
+        raise ValueError(f"{path} is not a synthetic audio file")
+    return json.loads(raw[len(SYNTHETIC_MAGIC):].decode("utf-8"))["duration"]
+
+def _make_tone_frame() -> bytes:
+    # A constant 440 Hz-ish square wave frame; the content is irrelevant, the size is what counts
+    half = bytes([0x00, 0x20, 0x00, 0x20]) * (FRAME_SIZE // 8)
+    low = bytes([0x00, 0xE0, 0x00, 0xE0]) * (FRAME_SIZE // 8)
+    return half + low
+
+# ---------------------- FAKE YT-DLP ----------------------
+class FakeDownloadError(Exception):
+    pass
+
+class FakeExtractorError(Exception):
+    pass
+
+class FakeCatalog:
+    """Canned metadata for playlists, videos and searches, with configurable latency."""
+
+    def __init__(self, *, track_seconds: float, extract_latency: float, download_latency: float,
+                 search_latency: float, jitter: float, throttle_rate: float = 0.0,
+                 server_capacity: float = 0.0, seed: int = 1):
+        self.track_seconds = track_seconds
+        self.extract_latency = extract_latency
+        self.download_latency = download_latency
+        self.search_latency = search_latency
+        self.jitter = jitter
+        # Throttling stand-in: random 429s, and/or 429s whenever calls exceed server_capacity per second
+        self.throttle_rate = throttle_rate
+        self.server_capacity = server_capacity
+        self._server_tokens = server_capacity
+        self._server_updated = time.monotonic()
+        self.throttled = 0
+        self.rng = random.Random(seed)
+        self.rng_lock = threading.Lock()
+        self.calls: Dict[str, int] = {}
+        self.calls_lock = threading.Lock()
+
+    @staticmethod
+    def video_id(guild_index: int, track_index: int) -> str:
+        return f"g{guild_index:04d}t{track_index:05d}"
+
+    @staticmethod
+    def playlist_url(guild_index: int) -> str:
+        return f"https://www.youtube.com/playlist?list=BENCH{guild_index:04d}"
+
+    def _sleep(self, base: float):
+        if base <= 0:
+            return
+        with self.rng_lock:
+            factor = 1.0 + self.rng.uniform(-self.jitter, self.jitter)
+        time.sleep(base * max(factor, 0.0))
+
+    def _count(self, kind: str):
+        with self.calls_lock:
+            self.calls[kind] = self.calls.get(kind, 0) + 1
+
+    def video_info(self, video_id: str) -> dict:
+        url = f"https://www.youtube.com/watch?v={video_id}"
+        return {
+            "id": video_id,
+            "title": f"Synthetic track {video_id}",
+            "uploader": "bench",
+            "webpage_url": url,
+            "url": url,
+            "duration": self.track_seconds,
+            "ext": "m4a",
+            "acodec": "mp4a.40.2",
+            "vcodec": "none",
+        }
+
+    def _maybe_throttle(self, url: str):
+        with self.rng_lock:
+            throttled = self.rng.random() < self.throttle_rate
+            if self.server_capacity > 0:
+                now = time.monotonic()
+                self._server_tokens = min(self.server_capacity,
+                                          self._server_tokens + (now - self._server_updated) * self.server_capacity)
+                self._server_updated = now
+                if self._server_tokens >= 1:
+                    self._server_tokens -= 1
+                else:
+                    throttled = True
+            if throttled:
+                self.throttled += 1
+        if throttled:
+            raise FakeDownloadError(f"ERROR: [youtube] {url}: HTTP Error 429: Too Many Requests")
+
+    def extract(self, ydl: "FakeYoutubeDL", url: str, download: bool) -> Optional[dict]:
+        self._maybe_throttle(url)
+        if url.startswith("ytsearch"):
+            prefix, _, query = url.partition(":")
+            count = int(prefix[len("ytsearch"):] or 1)
+            self._count("search")
+            self._sleep(self.search_latency)
+            entries = [self.video_info(f"s{abs(hash((query, i))) % 10**10:010d}") for i in range(count)]
+            if download:
+                for entry in entries:
+                    self._download(ydl, entry)
+            return {"_type": "playlist", "entries": entries} if not download else {"entries": entries}
+
+        if "list=BENCH" in url:
+            self._count("playlist")
+            self._sleep(self.extract_latency)
+            guild_index = int(url.rsplit("BENCH", 1)[1][:4])
+            tracks = ydl.catalog_playlist_sizes.get(guild_index, 0)
+            entries = []
+            for t in range(tracks):
+                vid = self.video_id(guild_index, t)
+                entries.append({"id": vid, "url": f"https://www.youtube.com/watch?v={vid}",
+                                "title": f"Synthetic track {vid}", "duration": self.track_seconds})
+            return {"_type": "playlist", "title": f"Bench playlist {guild_index}", "entries": entries}
+
+        if "watch?v=" in url:
+            video_id = url.split("watch?v=", 1)[1][:11]
+            self._count("extract")
+            self._sleep(self.extract_latency)
+            info = self.video_info(video_id)
+            if download:
+                self._download(ydl, info)
+            return info
+
+        raise FakeDownloadError(f"ERROR: Unsupported URL: {url}")
+
+    def _download(self, ydl: "FakeYoutubeDL", info: dict):
+        self._count("download")
+        self._sleep(self.download_latency)
+        write_synthetic_audio(ydl.prepare_filename(info), info["duration"])
+
+class FakeYoutubeDL:
+    catalog: Optional[FakeCatalog] = None
+    catalog_playlist_sizes: Dict[int, int] = {}
+
+    def __init__(self, params: Optional[dict] = None):
+        self.params = dict(params or {})
+
+    def extract_info(self, url: str, download: bool = True, **kwargs):
+        return self.catalog.extract(self, url, download)
+
+    def process_ie_result(self, info: dict, download: bool = True, **kwargs):
+        # Re-processing already resolved metadata: no extraction, only the download
+        self.catalog._count("process")
+        if download:
+            self.catalog._download(self, info)
+        return info
+
+    def prepare_filename(self, info: dict) -> str:
+        return str(self.params.get("outtmpl", "%(id)s.%(ext)s")) % info
+
+    def get_info_extractor(self, name: str):
+        return None
+
+def install_fake_yt_dlp() -> types.ModuleType:
+    """Register a fake `yt_dlp` module so app.get_yt_dlp() picks it up instead of the real one."""
+    module = types.ModuleType("yt_dlp")
+    utils = types.ModuleType("yt_dlp.utils")
+    utils.DownloadError = FakeDownloadError
+    utils.ExtractorError = FakeExtractorError
+    module.utils = utils
+    module.YoutubeDL = FakeYoutubeDL
+    sys.modules["yt_dlp"] = module
+    sys.modules["yt_dlp.utils"] = utils
+    return module
+
+# ---------------------- FAKE DISCORD OBJECTS ----------------------
+def build_fakes(discord, stats: BenchStats, stall_rate: float = 0.0, stall_seconds: float = 0.0):
+    """Fake voice client / guild / channel / interaction classes bound to the installed discord module."""
+
+    class SyntheticPCMAudio(discord.AudioSource):
+        """Replaces FFmpegPCMAudio: yields precomputed PCM frames for the file's duration."""
+        TONE = _make_tone_frame()
+
+        def __init__(self, location: str, start: float = 0.0):
+            self.location = location
+            self.frames_left = int(max(_read_synthetic_duration(location) - start, 0.0) / FRAME_SECONDS)
+
+        def read(self) -> bytes:
+            if self.frames_left <= 0:
+                return b""
+            self.frames_left -= 1
+            if stall_rate and random.random() < stall_rate:
+                time.sleep(stall_seconds)  # ffmpeg / pipe hiccup stand-in
+            return self.TONE
+
+        def is_opus(self) -> bool:
+            return False
+
+        def cleanup(self):
+            self.frames_left = 0
+
+    class FakeVoiceClient:
+        """Consumes frames on a 20 ms clock in its own thread, like discord.py's AudioPlayer."""
+
+        def __init__(self, guild, channel):
+            self.guild = guild
+            self.channel = channel
+            self._source = None
+            self._thread: Optional[threading.Thread] = None
+            self._end = threading.Event()
+            self._resumed = threading.Event()
+            self._resumed.set()
+            self._active = False
+
+        def play(self, source, *, after=None, **kwargs):
+            if self.is_playing():
+                raise discord.ClientException("Already playing audio.")
+            self._source = source
+            self._end = threading.Event()
+            self._resumed.set()
+            self._active = True
+            self._thread = threading.Thread(target=self._run, args=(source, after, self._end), daemon=True)
+            self._thread.start()
+
+        def _run(self, source, after, end: threading.Event):
+            error = None
+            frames = 0
+            next_tick = time.perf_counter()
+            try:
+                while not end.is_set():
+                    if not self._resumed.is_set():
+                        self._resumed.wait()
+                        next_tick = time.perf_counter()
+                        continue
+                    data = source.read()
+                    if frames == 0:
+                        stats.first_frame(self.guild.id, time.perf_counter())
+                    if not data:
+                        break
+                    frames += 1
+                    next_tick += FRAME_SECONDS
+                    delay = next_tick - time.perf_counter()
+                    if delay > 0:
+                        time.sleep(delay)
+            except Exception as e:
+                error = e
+            finally:
+                end.set()
+                self._active = False
+                stats.track_end(self.guild.id, time.perf_counter(), frames)
+                if after is not None:
+                    try:
+                        after(error)
+                    except Exception:
+                        pass
+                try:
+                    source.cleanup()
+                except Exception:
+                    pass
+
+        def is_playing(self) -> bool:
+            return self._active and self._resumed.is_set() and not self._end.is_set()
+
+        def is_paused(self) -> bool:
+            return self._active and not self._resumed.is_set() and not self._end.is_set()
+
+        def pause(self):
+            self._resumed.clear()
+
+        def resume(self):
+            self._resumed.set()
+
+        def stop(self):
+            self._end.set()
+            self._resumed.set()
+
+        async def disconnect(self, *, force: bool = False):
+            self.stop()
+            self.guild.voice_client = None
+
+    class FakeMessage:
+        def __init__(self, channel):
+            self.channel = channel
+            self.id = random.getrandbits(48)
+
+        async def edit(self, **kwargs):
+            stats.api("message_edit")
+            return self
+
+    class FakeTextChannel:
+        def __init__(self, channel_id: int):
+            self.id = channel_id
+
+        async def send(self, content=None, **kwargs):
+            stats.api("channel_send")
+            return FakeMessage(self)
+
+    class FakeVoiceChannel:
+        def __init__(self, guild):
+            self.guild = guild
+            self.id = guild.id * 10 + 1
+            self.name = f"voice-{guild.id}"
+            self.members = [object(), object()]
+
+        async def connect(self, **kwargs):
+            vc = FakeVoiceClient(self.guild, self)
+            self.guild.voice_client = vc
+            return vc
+
+    class FakeGuild:
+        def __init__(self, guild_id: int):
+            self.id = guild_id
+            self.name = f"bench-{guild_id}"
+            self.voice_client = None
+            self.voice_channel = FakeVoiceChannel(self)
+            self.text_channel = FakeTextChannel(guild_id * 10)
+
+    class FakeResponse:
+        async def send_message(self, *args, **kwargs):
+            stats.api("interaction_response")
+
+    class FakeFollowup:
+        async def send(self, *args, **kwargs):
+            stats.api("interaction_followup")
+
+    class FakeInteraction:
+        def __init__(self, guild):
+            self.guild = guild
+            self.guild_id = guild.id
+            self.channel_id = guild.text_channel.id
+            self.user = types.SimpleNamespace(voice=types.SimpleNamespace(channel=guild.voice_channel), name="bench")
+            self.response = FakeResponse()
+            self.followup = FakeFollowup()
+
+    return types.SimpleNamespace(
+        SyntheticPCMAudio=SyntheticPCMAudio,
+        FakeGuild=FakeGuild,
+        FakeInteraction=FakeInteraction,
+    )
+
+# ---------------------- SCENARIO ----------------------
+async def sample_loop_lag(stats: BenchStats, stop: asyncio.Event, interval: float = 0.05):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        stats.loop_lag.append(max(time.perf_counter() - started - interval, 0.0))
+
+async def autocomplete_load(app, calls: int, stats: BenchStats):
+    """Simulate a user typing a query: every prefix hits yt_autocomplete, repeats hit the cache."""
+    words = "never gonna give you up"
+    latencies = []
+    for i in range(calls):
+        prefix = words[:max(3, (i % len(words)) + 1)]
+        started = time.perf_counter()
+        await app.yt_autocomplete(prefix)
+        latencies.append(time.perf_counter() - started)
+        await asyncio.sleep(0.05)
+    return latencies
+
+async def drain_after(app, delay: float, report: dict):
+    """SIGTERM stand-in: drain mid-run, then check what a restart would find on disk."""
+    await asyncio.sleep(delay)
+
+    async def no_close():
+        pass
+
+    app.bot.close = no_close  # the bench bot never logged in
+    started = time.perf_counter()
+    await app.shutdown.drain("bench")
+    report["seconds"] = time.perf_counter() - started
+    try:
+        state = json.loads(app.RESUME_STATE.read_text(encoding="utf-8"))
+        report["resume_tracks"] = sum(len(g["tracks"]) for g in state["guilds"].values())
+    except FileNotFoundError:
+        report["resume_tracks"] = 0
+    try:
+        indexed = {Path(r["filepath"]).name for r in json.loads(app.TRACK_CACHE_INDEX.read_text(encoding="utf-8"))}
+    except FileNotFoundError:
+        indexed = set()
+    report["cached_files"] = len(indexed)
+    # Anything else left in the download folder is garbage the restarted bot wouldn't know about
+    # (a shared cache instance removes its scratch dir altogether)
+    leftovers = app.DOWNLOAD_DIR.iterdir() if app.DOWNLOAD_DIR.exists() else ()
+    report["leftover_files"] = len([f for f in leftovers if f.is_file() and f.name not in indexed])
+    report["scratch_dir_left"] = app.shared_cache.enabled and app.DOWNLOAD_DIR.exists()
+    report["uncleaned_sources"] = len([s for s in app._live_sources if not s.cleaned_up])
+
+async def stop_after(app, fakes, guilds: dict, delay: float, report: dict):
+    """/stop in every guild while its playlist is still loading; nothing may play afterwards."""
+    await asyncio.sleep(delay)
+    report["loading_at_stop"] = sum(1 for gid in guilds if app.get_player(gid).is_loading_playlist)
+    for guild in guilds.values():
+        await app.stop.callback(fakes.FakeInteraction(guild))
+    await asyncio.sleep(3.0)
+    players = [app.get_player(gid) for gid in guilds]
+    report["playing_after_stop"] = sum(1 for g in guilds.values() if g.voice_client and g.voice_client.is_playing())
+    report["current_after_stop"] = sum(1 for p in players if p.current is not None)
+    report["queued_after_stop"] = sum(len(p.queue) for p in players)
+
+def read_rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+async def run_scenario(app, fakes, stats: BenchStats, args) -> dict:
+    loop = asyncio.get_running_loop()
+    app.bot.loop = loop
+    guilds = {gid: fakes.FakeGuild(gid) for gid in range(1, args.guilds + 1)}
+    channels = {g.text_channel.id: g.text_channel for g in guilds.values()}
+    app.bot.get_guild = lambda gid: guilds.get(gid)
+    app.bot.get_channel = lambda cid: channels.get(cid)
+    FakeYoutubeDL.catalog_playlist_sizes = {gid: args.tracks for gid in guilds}
+
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(sample_loop_lag(stats, stop))
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+
+    async def drive_guild(guild):
+        interaction = fakes.FakeInteraction(guild)
+        for n in range(args.search_plays):
+            # Type a query keystroke by keystroke, pause on the suggestion, then submit it
+            query = f"bench guild {guild.id} song {n}"
+            choices = []
+            for end in range(4, len(query) + 1, 4):
+                choices = await app.play_query_autocomplete(interaction, query[:end])
+                await asyncio.sleep(0.1)
+            await asyncio.sleep(args.think_time)
+            if n == 0:
+                stats.play_requested[guild.id] = time.perf_counter()
+            await app.play.callback(interaction, choices[0].value)
+        if not args.search_plays:
+            stats.play_requested[guild.id] = time.perf_counter()
+        for n in range(1 + args.replays):
+            if n:
+                # Replay the same playlist with a couple of new entries appended
+                FakeYoutubeDL.catalog_playlist_sizes[guild.id] += args.replay_added
+            started = time.perf_counter()
+            await app.play.callback(interaction, FakeCatalog.playlist_url(guild.id))
+            (stats.repeat_playlist_loads if n else stats.first_playlist_loads).append(time.perf_counter() - started)
+
+    async def skip_randomly(guild):
+        # Exercise the skip / track-end race through the real /skip command
+        interaction = fakes.FakeInteraction(guild)
+        for _ in range(args.skips):
+            await asyncio.sleep(random.uniform(0.2, args.track_seconds))
+            await app.skip.callback(interaction)
+
+    autocomplete_tasks = [asyncio.create_task(autocomplete_load(app, args.autocomplete_calls, stats))
+                          for _ in range(max(1, args.guilds // 4))]
+    skip_tasks = [asyncio.create_task(skip_randomly(g)) for g in guilds.values()]
+    drain_report = {}
+    if args.drain_after:
+        drain_task = asyncio.create_task(drain_after(app, args.drain_after, drain_report))
+    stop_report = {}
+    if args.stop_after:
+        stop_task = asyncio.create_task(stop_after(app, fakes, guilds, args.stop_after, stop_report))
+    await asyncio.gather(*(drive_guild(g) for g in guilds.values()))
+    await asyncio.gather(*skip_tasks)
+    if args.drain_after:
+        await drain_task
+    if args.stop_after:
+        await stop_task
+
+    # Wait for every queue to drain
+    expected = args.guilds * (args.tracks * (1 + args.replays) + args.replays * (args.replays + 1) // 2 * args.replay_added
+                              + args.search_plays)
+    deadline = time.perf_counter() + args.timeout
+    while time.perf_counter() < deadline:
+        players = [app.players.get(gid) for gid in guilds]
+        idle = all(p is None or (p.current is None and not p.queue) for p in players)
+        if idle and (stats.tracks_finished >= expected or drain_report or stop_report):
+            break
+        await asyncio.sleep(0.05)
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+
+    autocomplete_latencies = [x for lat in await asyncio.gather(*autocomplete_tasks) for x in lat]
+    stop.set()
+    await lag_task
+    for player in list(app.players.values()):
+        player.panel.stop()
+
+    return {
+        "guilds": args.guilds,
+        "tracks_per_guild": args.tracks,
+        "skips_per_guild": args.skips,
+        "search_plays_per_guild": args.search_plays,
+        "tracks_finished": stats.tracks_finished,
+        "tracks_expected": expected,
+        "wall_seconds": wall,
+        "throughput_tracks_per_second": stats.tracks_finished / wall if wall else 0.0,
+        "audio_frames": stats.frames,
+        "time_to_first_audio": percentiles(stats.time_to_first_audio),
+        "inter_track_gap": percentiles(stats.inter_track_gaps),
+        "event_loop_lag": percentiles(stats.loop_lag),
+        "autocomplete_latency": percentiles(autocomplete_latencies),
+        "first_playlist_load": percentiles(stats.first_playlist_loads),
+        "repeat_playlist_load": percentiles(stats.repeat_playlist_loads),
+        "track_transition": {
+            label: child.count for label, child in
+            ((values[0], child) for values, child in app.track_transition_seconds._children.items())
+        },
+        "cpu_seconds": cpu,
+        "cpu_utilisation": cpu / wall if wall else 0.0,
+        "rss_bytes": read_rss_bytes(),
+        "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "discord_api_calls": dict(stats.api_calls),
+        "fake_ytdl_calls": dict(FakeYoutubeDL.catalog.calls),
+        "fake_throttle_responses": FakeYoutubeDL.catalog.throttled,
+        "speculative_prefetch": {
+            values[0]: child.value for values, child in app.speculative_prefetch_total._children.items()
+        },
+        "playlist_snapshot_entries": {
+            values[0]: child.value for values, child in app.playlist_snapshot_entries_total._children.items()
+        },
+        "audio_late_frames": sum(c.value for c in app.audio_late_frames_total._children.values()),
+        "audio_underruns": sum(c.value for c in app.audio_underruns_total._children.values()),
+        "audio_readahead_underruns": app.readahead_underruns_total.labels().value,
+        "audio_worst_guilds": app.audio_jitter_summary(),
+        "drain": drain_report,
+        "stop": stop_report,
+        "media_rate_final": app.media_limiter.rate,
+        "media_breaker_open": app.media_limiter.breaker_open(),
+    }
+
+def format_report(report: dict) -> str:
+    lines = ["=" * 60, "Music bot offline benchmark", "=" * 60]
+    for key, value in report.items():
+        if isinstance(value, dict) and "count" in value:
+            if value["count"] == 0:
+                lines.append(f"{key:30s} n=0")
+                continue
+            lines.append(
+                f"{key:30s} n={value['count']:<5d} p50={value['p50'] * 1000:8.1f}ms "
+                f"p95={value['p95'] * 1000:8.1f}ms p99={value['p99'] * 1000:8.1f}ms max={value['max'] * 1000:8.1f}ms"
+            )
+        elif isinstance(value, float):
+            lines.append(f"{key:30s} {value:.3f}")
+        else:
+            lines.append(f"{key:30s} {value}")
+    return "\n".join(lines)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline load test for the music bot")
+    parser.add_argument("--guilds", type=int, default=5, help="simulated guilds")
+    parser.add_argument("--tracks", type=int, default=5, help="playlist tracks per guild")
+    parser.add_argument("--track-seconds", type=float, default=2.0, help="synthetic track length")
+    parser.add_argument("--extract-latency", type=float, default=0.05, help="fake metadata extraction latency (s)")
+    parser.add_argument("--download-latency", type=float, default=0.2, help="fake download latency (s)")
+    parser.add_argument("--search-latency", type=float, default=0.1, help="fake search latency (s)")
+    parser.add_argument("--jitter", type=float, default=0.3, help="latency jitter as a fraction of the base")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of fake calls answered with HTTP 429")
+    parser.add_argument("--server-capacity", type=float, default=0.0,
+                        help="fake media source answers 429 above this many calls/s (0 = unlimited)")
+    parser.add_argument("--media-rate", type=float, default=None, help="override MEDIA_RATE for the bot")
+    parser.add_argument("--media-burst", type=int, default=None, help="override MEDIA_BURST for the bot")
+    parser.add_argument("--skips", type=int, default=0, help="random /skip calls per guild during playback")
+    parser.add_argument("--replays", type=int, default=0, help="queue each guild's playlist again this many times")
+    parser.add_argument("--replay-added", type=int, default=2, help="entries appended to the playlist before each replay")
+    parser.add_argument("--search-plays", type=int, default=0,
+                        help="per guild: type a query, then /play the top autocomplete suggestion")
+    parser.add_argument("--think-time", type=float, default=1.0, help="pause between the last keystroke and /play")
+    parser.add_argument("--speculative", action="store_true", help="enable speculative prefetch from autocomplete")
+    parser.add_argument("--autocomplete-calls", type=int, default=20, help="autocomplete calls per typing user")
+    parser.add_argument("--read-stall-rate", type=float, default=0.0, help="fraction of audio reads that stall")
+    parser.add_argument("--read-stall-ms", type=float, default=40.0, help="length of a stalled read (ms)")
+    parser.add_argument("--drain-after", type=float, default=0.0,
+                        help="start a graceful shutdown this many seconds into the run (0 = never)")
+    parser.add_argument("--stop-after", type=float, default=0.0,
+                        help="/stop every guild this many seconds into the run, mid playlist load (0 = never)")
+    parser.add_argument("--timeout", type=float, default=300.0, help="give up waiting for queues after this long")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    parser.add_argument("--verbose", action="store_true", help="keep the bot's INFO logging")
+    parser.add_argument("--keep-workdir", action="store_true", help="keep the temporary working directory")
+    return parser.parse_args(argv)
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    workdir = tempfile.mkdtemp(prefix="musicbot-bench-")
+    previous_cwd = os.getcwd()
+    # app.py creates logs/, data/ and music_downloads/ relative to the working directory
+    os.chdir(workdir)
+    sys.path.insert(0, str(REPO_ROOT))
+    try:
+        install_fake_yt_dlp()
+        FakeYoutubeDL.catalog = FakeCatalog(
+            track_seconds=args.track_seconds,
+            extract_latency=args.extract_latency,
+            download_latency=args.download_latency,
+            search_latency=args.search_latency,
+            jitter=args.jitter,
+            throttle_rate=args.throttle_rate,
+            server_capacity=args.server_capacity,
+        )
+        if args.media_rate is not None:
+            os.environ["MEDIA_RATE"] = str(args.media_rate)
+        if args.media_burst is not None:
+            os.environ["MEDIA_BURST"] = str(args.media_burst)
+        if args.speculative:
+            os.environ["SPECULATIVE_PREFETCH"] = "1"
+            os.environ["SPECULATIVE_DOWNLOAD"] = "1"
+        import logging
+        import discord
+        import app
+
+        if not args.verbose:
+            app.logger.setLevel(logging.WARNING)
+        stats = BenchStats()
+        fakes = build_fakes(discord, stats, args.read_stall_rate, args.read_stall_ms / 1000)
+        app.create_audio_source = fakes.SyntheticPCMAudio
+
+        report = asyncio.run(run_scenario(app, fakes, stats, args))
+        app.ytdl_executor.shutdown(wait=False)
+        print(json.dumps(report, indent=2) if args.json else format_report(report))
+        if args.drain_after:
+            return 0 if report["drain"].get("leftover_files") == 0 else 1
+        if args.stop_after:
+            stopped = report["stop"]
+            return 0 if not (stopped["playing_after_stop"] or stopped["current_after_stop"]
+                             or stopped["queued_after_stop"]) else 1
+        return 0 if report["tracks_finished"] >= report["tracks_expected"] else 1
+    finally:
+        os.chdir(previous_cwd)
+        if not args.keep_workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    sys.exit(main())